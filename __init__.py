@@ -31,6 +31,12 @@ def classFactory(iface):  # pylint: disable=invalid-name
     :type iface: QgsInterface
     """
     #
+    from .timing import startup_timer
+
+    startup_timer.start()
     from .layertreeicons import LayerTreeIcons
 
-    return LayerTreeIcons(iface)
+    startup_timer.mark("import")
+    plugin = LayerTreeIcons(iface)
+    startup_timer.mark("__init__")
+    return plugin
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+""" Micro-benchmarks of the plugin hot paths, run on synthetic projects in a
+headless QGIS.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json
+
+Results are written as JSON: {"meta": {...}, "results": {name: stats}}, with
+the timings in microseconds. Given a baseline, the benchmarks whose mean or p95
+time regressed by more than the threshold are listed, and the exit code is 1.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+from time import perf_counter
+
+import shim
+
+APP, IFACE = shim.start()
+
+from PyQt5.QtCore import QModelIndex, Qt  # noqa: E402
+from PyQt5.QtWidgets import QMenu  # noqa: E402
+from qgis.core import Qgis, QgsLayerTreeModel, QgsProject  # noqa: E402
+
+import scenarios  # noqa: E402
+
+# The plugin folder is imported as a package, so that its relative imports work
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+PLUGIN = os.path.basename(PLUGIN_DIR)
+
+
+def plugin_module(name):
+    return importlib.import_module(f"{PLUGIN}.{name}")
+
+
+customtreemodel = plugin_module("customtreemodel")
+legendpixmap = plugin_module("legendpixmap")
+menuprovider = plugin_module("menuprovider")
+iconcache = plugin_module("iconcache")
+
+
+ROLES = {
+    "display": Qt.DisplayRole,
+    "decoration": Qt.DecorationRole,
+    "font": Qt.FontRole,
+    "foreground": Qt.ForegroundRole,
+    "background": Qt.BackgroundRole,
+}
+
+ICONS = (
+    ":/images/themes/default/mActionFolder.svg",
+    ":/images/themes/default/mIconPointLayer.svg",
+    ":/images/themes/default/mIconRaster.svg",
+    ":/images/themes/default/mActionZoomIn.svg",
+)
+
+
+def stats(samples):
+    """ Summary of durations in seconds, in microseconds """
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        "count": count,
+        "mean_us": sum(samples) / count * 1e6,
+        "p50_us": samples[count // 2] * 1e6,
+        "p95_us": samples[min(count - 1, int(count * 0.95))] * 1e6,
+        "total_ms": sum(samples) * 1e3,
+    }
+
+
+def indexes(model, parent=QModelIndex()):
+    """ All the indexes of the model, legend nodes included """
+    for row in range(model.rowCount(parent)):
+        index = model.index(row, 0, parent)
+        yield index
+        yield from indexes(model, index)
+
+
+def clear_caches(model):
+    model.clear_decoration_cache()
+    model.font_cache.clear()
+    legendpixmap.legend_pixmap_cache.clear()
+    iconcache.icon_cache.clear()
+
+
+def install_model():
+    """ Replace the view model with a new CustomTreeModel """
+    view = IFACE.layerTreeView()
+    previous = view.model()
+    model = customtreemodel.CustomTreeModel()
+    model.setFlag(QgsLayerTreeModel.ShowLegend, True)
+    view.setModel(model)
+    if previous is not None:
+        # Disconnect the previous model from the project and layer signals
+        if hasattr(previous, "teardown"):
+            previous.teardown()
+        previous.deleteLater()
+    APP.processEvents()
+    return model
+
+
+def bench_data(model, results, scenario):
+    all_indexes = list(indexes(model))
+    for role_name, role in ROLES.items():
+        clear_caches(model)
+        for state in ("cold", "warm"):
+            samples = []
+            for index in all_indexes:
+                start = perf_counter()
+                model.data(index, role)
+                samples.append(perf_counter() - start)
+            results[f"{scenario}/data/{role_name}/{state}"] = stats(samples)
+
+
+def bench_legend(model, results, scenario):
+    legend_nodes = [
+        legend_node
+        for layer_node in QgsProject.instance().layerTreeRoot().findLayers()
+        for legend_node in model.layerLegendNodes(layer_node)
+    ]
+    if not legend_nodes:
+        return
+
+    legendpixmap.legend_pixmap_cache.clear()
+    for state in ("cold", "warm"):
+        samples = []
+        for legend_node in legend_nodes:
+            start = perf_counter()
+            legendpixmap.pixmapForLegendNode(legend_node)
+            samples.append(perf_counter() - start)
+        results[f"{scenario}/legend_pixmap/{state}"] = stats(samples)
+
+
+def bench_context_menu(results, scenario, repeat):
+    view = IFACE.layerTreeView()
+    layers = QgsProject.instance().layerTreeRoot().findLayers()
+    if not layers:
+        return
+
+    provider = menuprovider.LayerTreeMenuProvider()
+    for selected in (1, 100):
+        view.setCurrentIndex(view.model().node2index(layers[0]))
+        selection = view.selectionModel()
+        for node in layers[:selected]:
+            selection.select(view.model().node2index(node), selection.Select)
+
+        samples = []
+        for _ in range(repeat):
+            menu = QMenu()
+            start = perf_counter()
+            provider.customize(menu)
+            samples.append(perf_counter() - start)
+            menu.deleteLater()
+        selection.clearSelection()
+        results[f"{scenario}/context_menu/{selected}"] = stats(samples)
+
+
+def bench_resource_browser(results, repeat):
+    try:
+        resourcebrowserimpl = plugin_module("resourcebrowserimpl")
+    except ImportError as e:
+        # The .ui file is compiled when the plugin is deployed
+        print(f"Skipping the resource browser benchmark: {e}")
+        return
+
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        browser = resourcebrowserimpl.ResourceBrowser()
+        samples.append(perf_counter() - start)
+        browser.deleteLater()
+        APP.processEvents()
+    results["resource_browser/startup"] = stats(samples)
+
+
+def run(args):
+    def custom():
+        scenarios.flat(args.layers)
+        scenarios.custom_styles(ICONS)
+
+    builders = {
+        "flat": lambda: scenarios.flat(args.layers),
+        "deep": lambda: scenarios.deep(args.depth),
+        "categorized": lambda: scenarios.categorized(args.classes),
+        "custom": custom,
+    }
+
+    results = {}
+    for scenario in args.scenarios:
+        QgsProject.instance().clear()
+        start = perf_counter()
+        builders[scenario]()
+        print(f"{scenario}: project built in {perf_counter() - start:.1f} s")
+
+        model = install_model()
+        bench_data(model, results, scenario)
+        bench_legend(model, results, scenario)
+        bench_context_menu(results, scenario, args.repeat)
+
+    bench_resource_browser(results, args.repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Print the benchmarks which regressed, and return their number """
+    regressions = 0
+    for name, current in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key in ("mean_us", "p95_us"):
+            if reference[key] <= 0:
+                continue
+            ratio = current[key] / reference[key]
+            if ratio > 1 + threshold:
+                regressions += 1
+                print(
+                    f"REGRESSION {name} {key}: {reference[key]:.1f} -> "
+                    f"{current[key]:.1f} us ({ratio:.2f}x)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown reported as a regression (default: 0.2)",
+    )
+    parser.add_argument("--layers", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=100)
+    parser.add_argument("--classes", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=["flat", "deep", "categorized", "custom"],
+        choices=["flat", "deep", "categorized", "custom"],
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    output = {
+        "meta": {
+            "qgis": Qgis.QGIS_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "arguments": vars(args),
+        },
+        "results": results,
+    }
+
+    for name, result in sorted(results.items()):
+        print(
+            f"{name:45} n={result['count']:<6} mean={result['mean_us']:9.1f} us "
+            f"p95={result['p95_us']:9.1f} us"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    code = main()
+    QgsProject.instance().clear()
+    sys.exit(code)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+""" Synthetic projects for the benchmarks """
+
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import QColor, QFont
+
+from qgis.core import (
+    QgsCategorizedSymbolRenderer,
+    QgsField,
+    QgsProject,
+    QgsRendererCategory,
+    QgsSymbol,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
+
+
+GEOMETRIES = ("Point", "LineString", "Polygon", "None")
+
+
+def descendants(node):
+    for child in node.children():
+        yield child
+        yield from descendants(child)
+
+
+def memory_layer(name, geometry="Point"):
+    return QgsVectorLayer(f"{geometry}?crs=EPSG:4326", name, "memory")
+
+
+def flat(layers):
+    """ A single level tree of layers of every geometry type """
+    QgsProject.instance().addMapLayers(
+        [
+            memory_layer(f"layer {i}", GEOMETRIES[i % len(GEOMETRIES)])
+            for i in range(layers)
+        ]
+    )
+
+
+def deep(depth, layers_per_group=2):
+    """ Groups nested depth levels deep, with a few layers in each group """
+    project = QgsProject.instance()
+    group = project.layerTreeRoot()
+    for level in range(depth):
+        group = group.addGroup(f"group {level}")
+        for i in range(layers_per_group):
+            layer = memory_layer(f"layer {level}.{i}")
+            project.addMapLayer(layer, False)
+            group.addLayer(layer)
+
+
+def categorized(classes, layers=1):
+    """ Layers with a categorized renderer of many classes """
+    for i in range(layers):
+        layer = memory_layer(f"categorized {i}", "Polygon")
+        layer.dataProvider().addAttributes([QgsField("class", QVariant.Int)])
+        layer.updateFields()
+
+        categories = []
+        for value in range(classes):
+            symbol = QgsSymbol.defaultSymbol(QgsWkbTypes.PolygonGeometry)
+            symbol.setColor(QColor.fromHsv(value * 37 % 360, 200, 200))
+            categories.append(QgsRendererCategory(value, symbol, f"class {value}"))
+        layer.setRenderer(QgsCategorizedSymbolRenderer("class", categories))
+        QgsProject.instance().addMapLayer(layer)
+
+
+def custom_styles(icons):
+    """ Set a custom icon, font and colors on every node of the project """
+    font = QFont("Sans", 10)
+    font.setItalic(True)
+    for i, node in enumerate(descendants(QgsProject.instance().layerTreeRoot())):
+        node.setCustomProperty("plugins/customTreeIcon/icon", icons[i % len(icons)])
+        node.setCustomProperty("plugins/customTreeIcon/font", font.toString())
+        node.setCustomProperty("plugins/customTreeIcon/textColor", "#aa0000")
+        node.setCustomProperty("plugins/customTreeIcon/backgroundColor", "#eeeeee")
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+""" Headless QGIS application, with the subset of QgisInterface used by the
+plugin """
+
+import os
+
+# Must be set before the QApplication is created
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import qgis.utils  # noqa: E402
+from PyQt5.QtWidgets import QMainWindow  # noqa: E402
+from qgis.core import QgsApplication, QgsLayerTreeModel, QgsProject  # noqa: E402
+from qgis.gui import QgsLayerTreeView, QgsMapCanvas  # noqa: E402
+
+
+class Iface:
+    """ Stand-in for the QgisInterface, with a real layer tree view and map
+    canvas """
+
+    def __init__(self):
+        self.main_window = QMainWindow()
+        self.canvas = QgsMapCanvas(self.main_window)
+        self.view = QgsLayerTreeView(self.main_window)
+        self.view.setModel(
+            QgsLayerTreeModel(QgsProject.instance().layerTreeRoot(), self.view)
+        )
+        self.view.resize(400, 800)
+
+    def mainWindow(self):
+        return self.main_window
+
+    def mapCanvas(self):
+        return self.canvas
+
+    def layerTreeView(self):
+        return self.view
+
+
+def start():
+    """ Start QGIS and install the iface shim. Must be called before importing
+    the plugin modules, which import iface from qgis.utils """
+    app = QgsApplication([], True)
+    QgsApplication.initQgis()
+    iface = Iface()
+    qgis.utils.iface = iface
+    return app, iface
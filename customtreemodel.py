@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import json
+from contextlib import contextmanager
+from functools import partial
+
 from PyQt5.QtCore import (
+    QModelIndex,
+    QPersistentModelIndex,
     QSettings,
     QSize,
+    QTimer,
     Qt,
-    QPointF,
 )
-from PyQt5.QtGui import QIcon, QPixmap, QPainter, QFontMetricsF, QColor
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QFont
 
 from qgis.core import (
+    Qgis,
+    QgsMessageLog,
     QgsProject,
     QgsLayerTreeModel,
     QgsLayerTree,
@@ -16,290 +24,833 @@ from qgis.core import (
     QgsApplication,
     QgsWkbTypes,
     QgsMapLayer,
-    QgsSymbolLegendNode,
-    QgsSymbolLayerUtils,
-    QgsTextRenderer,
-    QgsRenderContext,
-    qgsDoubleNear,
-    QgsMapToPixel,
 )
-from qgis.utils import iface, QgsMessageLog
+from qgis.utils import iface
 
+from .iconcache import icon_cache
+from .legendpixmap import (
+    pixmapForLegendNode,
+    legend_pixmap_cache,
+    async_legend_renderer,
+)
+from .rules import RuleStyle
+from .scaleindex import ScaleRangeIndex
+from .stylebatch import StyleBatch
+from .styleconfig import StyleConfig
+from .stylepalette import (
+    FONT_KEY,
+    PROPERTY_FIELDS,
+    STYLE_KEY,
+    StylePalette,
+    style_registry,
+)
+from .viewporttracker import ViewportTracker
 
-def createTemporaryRenderContext():
 
-    layerModel = iface.layerTreeView().model()
-    mupp, dpi, scale = layerModel.legendMapViewData()
+NO_STYLE = RuleStyle()
 
-    if qgsDoubleNear(mupp, 0.0) or dpi == 0 or qgsDoubleNear(scale, 0.0):
-        return None
 
-    render_context = QgsRenderContext()
-    render_context.setScaleFactor(dpi / 25.4)
-    render_context.setRendererScale(scale)
-    render_context.setMapToPixel(QgsMapToPixel(mupp))
-    return render_context
+def node_category(node):
+    """ Return the default icon category of a node (see DEFAULT_ICONS), or None """
+    if QgsLayerTree.isGroup(node):
+        return "group"
 
+    layer = node.layer() if QgsLayerTree.isLayer(node) else None
+    if not layer:
+        return None
 
-def pixmapForLegendNode(legend_node):
+    if layer.type() == QgsMapLayer.RasterLayer:
+        return "raster"
 
-    # handles only symbol nodes
-    if not isinstance(legend_node, QgsSymbolLegendNode):
-        return
+    if layer.type() == QgsMapLayer.VectorLayer:
+        return {
+            QgsWkbTypes.PointGeometry: "point",
+            QgsWkbTypes.LineGeometry: "line",
+            QgsWkbTypes.PolygonGeometry: "polygon",
+            QgsWkbTypes.NullGeometry: "nogeometry",
+        }.get(layer.geometryType())
 
-    # If size is default, use default implementation
-    size = iface.layerTreeView().iconSize()
-    if size.width() in (-1, 16):
-        size = QSize(18, 18)
+    try:
+        if layer.type() == QgsMapLayer.MeshLayer:
+            return "mesh"
+    except AttributeError:
+        pass
 
-    symbol = legend_node.symbol()
-    if not symbol:
-        return
+    return None
 
-    # Compute minimum width
-    model = iface.layerTreeView().model()
-    if not legend_node.layerNode():
-        return
 
-    text = legend_node.textOnSymbolLabel()
+def walk(node):
+    """ Yield a node and all its descendants """
+    yield node
+    for child in node.children():
+        yield from walk(child)
 
-    minimum_width = max(
-        max(
-            l_node.minimumIconSize().width() + (8 if text else 0)
-            for l_node in model.layerLegendNodes(legend_node.layerNode())
-            if isinstance(l_node, QgsSymbolLegendNode)
-        ),
-        size.width(),
-    )
 
-    symbol_size = QSize(minimum_width, size.height())
-    context = QgsRenderContext.fromMapSettings(iface.mapCanvas().mapSettings())
-    pixmap = QgsSymbolLayerUtils.symbolPreviewPixmap(symbol, symbol_size, 0, context)
+class CustomTreeModel(QgsLayerTreeModel):
+    """ Custom tree model which handles custom icons on nodes """
 
-    if text:
-        painter = QPainter(pixmap)
-        text_format = legend_node.textOnSymbolTextFormat()
+    def __init__(self, parent=None):
+        super().__init__(QgsProject.instance().layerTreeRoot(), parent)
+        self.setFlags(iface.layerTreeView().layerTreeModel().flags())
+        self.style = StyleConfig.load()
+
+        # Decoration cache, without the edition overlay:
+        # {index internal id: {(icon size, device pixel ratio): QPixmap}}
+        self.decoration_cache = {}
+
+        # Default icons of the categories, rasterized for the view:
+        # {category: QPixmap}, valid for (icon size, device pixel ratio)
+        self.category_pixmaps = {}
+        self.category_pixmaps_key = None
+
+        # Parsed fonts: {(font string or node type, current, dimmed): QFont}
+        self.font_cache = {}
+
+        # Current StyleBatch, see batch_update
+        self.batch = None
+
+        # Styles of the project nodes, see stylepalette.py. The palette is
+        # written in the project once per event loop iteration at most
+        self.palette = StylePalette()
+        self.palette_timer = QTimer(self)
+        self.palette_timer.setSingleShot(True)
+        self.palette_timer.setInterval(0)
+        self.palette_timer.timeout.connect(self.save_palette)
+        self.load_palette()
+        QgsProject.instance().readProject.connect(self.on_project_read)
+        QgsProject.instance().cleared.connect(self.palette.clear)
+
+        # Rows out of view which got a default icon: {internal id: index}
+        self.lazy_indexes = {}
+        self.viewport_tracker = ViewportTracker(iface.layerTreeView(), self)
+        self.viewport_tracker.set_margin(self.style.prefetch_rows)
+        self.viewport_tracker.changed.connect(self.on_viewport_changed)
+
+        self.rootGroup().customPropertyChanged.connect(self.on_custom_property_changed)
+        self.rowsAboutToBeRemoved.connect(self.on_rows_about_to_be_removed)
+        self.modelReset.connect(self.clear_decoration_cache)
+        self.rowsInserted.connect(self.on_rows_inserted)
+
+        # Layers out of their scale range
+        self.scale_index = ScaleRangeIndex()
+
+        # Nodes of each category: {category: {internal id: node}}
+        self.category_nodes = {}
+        self.node_categories = {}
+        # Nodes of each layer: {layer id: {internal id: node}}
+        self.layer_node_index = {}
+        self.rootGroup().addedChildren.connect(self.on_added_children)
+        self.rootGroup().willRemoveChildren.connect(self.on_will_remove_children)
+        # Editable layer nodes: {internal id: layer is modified}
+        self.edit_states = {}
+        # Icons composited with the edition overlay
+        self.overlay_cache = {}
+        # Style of the nodes matched by the rules: {internal id: RuleStyle}
+        self.rule_styles = {}
+        self.rootGroup().nameChanged.connect(self.on_name_changed)
+
+        for node in self.rootGroup().children():
+            for child in walk(node):
+                self.index_layer_node(child)
+                self.update_category(child)
+                self.update_edit_state(child)
+                self.update_rule_style(child)
+
+        # Signals of the project layers: {layer id: [(signal, slot)]}
+        self.layer_connections = {}
+        QgsProject.instance().layersAdded.connect(self.connect_layers)
+        QgsProject.instance().layersWillBeRemoved.connect(self.on_layers_removed)
+        self.connect_layers(QgsProject.instance().mapLayers().values())
+
+        iface.mapCanvas().scaleChanged.connect(self.on_scale_changed)
+        self.scale_index.set_scale(iface.mapCanvas().scale())
+
+    def connect_layers(self, layers):
+        """ Keep the caches and indexes of the layer nodes up to date when the
+        layer renderer, geometry, source, CRS, scale range or edition state
+        change """
+        for layer in layers:
+            connect = partial(self.connect_layer_signal, layer)
+            connect("legendChanged", partial(self.on_legend_changed, layer.id()))
+
+            style_slot = partial(self.on_layer_style_changed, layer.id())
+            connect("rendererChanged", style_slot)
+            connect("styleChanged", style_slot)
+
+            # The scale range has no dedicated signal: the layer properties
+            # dialog triggers a repaint when it is applied
+            range_slot = partial(self.on_scale_range_changed, layer.id())
+            connect("repaintRequested", range_slot)
+            self.scale_index.update_layer(layer)
+
+            connect("crsChanged", partial(self.on_rule_input_changed, layer.id()))
+            if hasattr(layer, "dataSourceChanged"):
+                source_slot = partial(self.on_data_source_changed, layer.id())
+                connect("dataSourceChanged", source_slot)
+
+            if not isinstance(layer, QgsVectorLayer):
+                continue
+
+            edit_slot = partial(self.on_edit_state_changed, layer.id())
+            connect("editingStarted", edit_slot)
+            connect("editingStopped", edit_slot)
+            connect("layerModified", edit_slot)
+            connect("afterCommitChanges", edit_slot)
+            connect("afterRollBack", edit_slot)
+
+        for layer in layers:
+            for node in self.layer_nodes(layer.id()):
+                self.update_category(node)
+                self.update_edit_state(node)
+                self.update_rule_style(node)
+
+    def connect_layer_signal(self, layer, name, slot):
+        """ Connect a signal of a layer, and keep the connection to disconnect it
+        in teardown """
+        signal = getattr(layer, name)
+        signal.connect(slot)
+        self.layer_connections.setdefault(layer.id(), []).append((signal, slot))
+
+    def teardown(self):
+        """ Disconnect the model from the project, the layers, the layer tree
+        and the view, so that it can be deleted when the plugin is unloaded """
+        if self.palette_timer.isActive():
+            self.palette_timer.stop()
+            self.save_palette()
+        style_registry.save()
+
+        project = QgsProject.instance()
+        root = self.rootGroup()
+        connections = [
+            (project.readProject, self.on_project_read),
+            (project.cleared, self.palette.clear),
+            (project.layersAdded, self.connect_layers),
+            (project.layersWillBeRemoved, self.on_layers_removed),
+            (iface.mapCanvas().scaleChanged, self.on_scale_changed),
+            (root.customPropertyChanged, self.on_custom_property_changed),
+            (root.addedChildren, self.on_added_children),
+            (root.willRemoveChildren, self.on_will_remove_children),
+            (root.nameChanged, self.on_name_changed),
+        ]
+        for layer_connections in self.layer_connections.values():
+            connections.extend(layer_connections)
+        self.layer_connections.clear()
+
+        for signal, slot in connections:
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                # Already disconnected, or the sender was deleted
+                pass
+
+        self.viewport_tracker.teardown()
+
+    def layer_nodes(self, layer_id):
+        """ Return all the layer tree nodes which reference the given layer """
+        return list(self.layer_node_index.get(layer_id, {}).values())
+
+    def index_layer_node(self, node):
+        if QgsLayerTree.isLayer(node):
+            internal_id = self.node2index(node).internalId()
+            self.layer_node_index.setdefault(node.layerId(), {})[internal_id] = node
+
+    def unindex_layer_node(self, node, internal_id):
+        if QgsLayerTree.isLayer(node):
+            nodes = self.layer_node_index.get(node.layerId(), {})
+            nodes.pop(internal_id, None)
+            if not nodes:
+                self.layer_node_index.pop(node.layerId(), None)
+
+    def on_layer_changed(self, layer_id):
+        for node in self.layer_nodes(layer_id):
+            self.invalidate_decoration(node)
+
+    def on_data_source_changed(self, layer_id):
+        for node in self.layer_nodes(layer_id):
+            self.update_category(node)
+            self.update_rule_style(node)
+            self.invalidate_decoration(node)
+        self.emit_data_changed(
+            [self.node2index(node) for node in self.layer_nodes(layer_id)],
+            [Qt.FontRole, Qt.ForegroundRole, Qt.BackgroundRole],
+        )
+
+    def on_added_children(self, parent, first, last):
+        for node in parent.children()[first : last + 1]:
+            for child in walk(node):
+                # Node from another project
+                if self.palette.resolve(child):
+                    self.palette_timer.start()
+                self.index_layer_node(child)
+                self.update_category(child)
+                self.update_edit_state(child)
+                self.update_rule_style(child)
+
+    def on_will_remove_children(self, parent, first, last):
+        for node in parent.children()[first : last + 1]:
+            for child in walk(node):
+                internal_id = self.node2index(child).internalId()
+                self.unindex_layer_node(child, internal_id)
+                self.remove_category(internal_id)
+                self.edit_states.pop(internal_id, None)
+                self.rule_styles.pop(internal_id, None)
+
+    def update_rule_style(self, node):
+        """ Match a node against the rules. Return True if its style changed """
+        internal_id = self.node2index(node).internalId()
+        previous = self.rule_styles.get(internal_id)
+        style = self.style.rules.match(node, node_category(node))
+        if style is None:
+            self.rule_styles.pop(internal_id, None)
+        else:
+            self.rule_styles[internal_id] = style
+        return style != previous
+
+    def rule_style(self, index):
+        """ Return the RuleStyle of a node index, or an empty style """
+        return self.rule_styles.get(index.internalId(), NO_STYLE)
+
+    def refresh_rule_styles(self, nodes):
+        """ Match the nodes against the rules again, and repaint the nodes whose
+        style changed """
+        indexes = []
+        for node in nodes:
+            if self.update_rule_style(node):
+                index = self.node2index(node)
+                self.decoration_cache.pop(index.internalId(), None)
+                indexes.append(index)
+        self.emit_data_changed(
+            indexes,
+            [Qt.DecorationRole, Qt.FontRole, Qt.ForegroundRole, Qt.BackgroundRole],
+        )
+
+    def on_rule_input_changed(self, layer_id):
+        self.refresh_rule_styles(self.layer_nodes(layer_id))
+
+    def on_name_changed(self, node, name):
+        """ A node was renamed: the rules matching on the name of the node, or on
+        the names of the groups of its descendants, may change """
+        self.refresh_rule_styles(walk(node))
+
+    def update_edit_state(self, node):
+        """ Track the edition state of a layer node. Return True if it changed """
+        if not QgsLayerTree.isLayer(node):
+            return False
+
+        internal_id = self.node2index(node).internalId()
+        previous = self.edit_states.get(internal_id)
+        layer = node.layer()
+        if isinstance(layer, QgsVectorLayer) and layer.isEditable():
+            self.edit_states[internal_id] = layer.isModified()
+        else:
+            self.edit_states.pop(internal_id, None)
+        return self.edit_states.get(internal_id) != previous
+
+    def on_edit_state_changed(self, layer_id):
+        """ Repaint the nodes of a layer when it enters or leaves edition, or
+        gets modified """
+        indexes = [
+            self.node2index(node)
+            for node in self.layer_nodes(layer_id)
+            if self.update_edit_state(node)
+        ]
+        self.emit_data_changed(indexes, [Qt.DecorationRole])
+
+    def with_edit_state(self, index, pixmap):
+        """ Special case: In-edition vector layer. Draw an editing icon over
+        the custom icon. Adapted from QGIS source code (qgslayertreemodel.cpp) """
+        modified = self.edit_states.get(index.internalId())
+        if modified is None:
+            return pixmap
+
+        icon_size = self.icon_size()
+        key = (pixmap.cacheKey(), modified, icon_size)
+        overlay = self.overlay_cache.get(key)
+        if overlay is None:
+            # Never paint over a pixmap shared by the other caches
+            overlay = QPixmap(pixmap)
+            painter = QPainter(overlay)
+            painter.drawPixmap(
+                0,
+                0,
+                icon_size,
+                icon_size,
+                QgsApplication.getThemeIcon(
+                    ("/mIconEditableEdits.svg")
+                    if modified
+                    else ("/mActionToggleEditing.svg")
+                ).pixmap(icon_size, icon_size),
+            )
+            painter.end()
+            del painter
+            self.overlay_cache[key] = overlay
+        return overlay
+
+    def update_category(self, node):
+        """ Index the node by category, after it was added or its geometry
+        changed """
+        internal_id = self.node2index(node).internalId()
+        self.remove_category(internal_id)
+        category = node_category(node)
+        if category:
+            self.category_nodes.setdefault(category, {})[internal_id] = node
+            self.node_categories[internal_id] = category
+
+    def remove_category(self, internal_id):
+        category = self.node_categories.pop(internal_id, None)
+        if category:
+            self.category_nodes[category].pop(internal_id, None)
+
+    def refresh_category(self, category):
+        """ Reload the settings after the default icon of a category changed and
+        repaint the nodes of this category which do not have a custom icon """
+        self.style = StyleConfig.load()
+        self.rasterize_category_icons()
+
+        indexes = []
+        for internal_id, node in self.category_nodes.get(category, {}).items():
+            if self.palette.node_style(node).icon:
+                continue
+            if self.rule_styles.get(internal_id, NO_STYLE).icon:
+                continue
+            if self.embedded_legend_node(node):
+                continue
+            self.decoration_cache.pop(internal_id, None)
+            indexes.append(self.node2index(node))
+        self.emit_data_changed(indexes, [Qt.DecorationRole])
+
+    def emit_data_changed(self, indexes, roles):
+        """ Emit dataChanged for each range of contiguous rows among indexes """
+        rows = {}
+        for index in indexes:
+            if index.isValid():
+                parent = index.parent()
+                rows.setdefault(parent.internalId(), (parent, []))[1].append(
+                    index.row()
+                )
 
-        try:
-            text_context = createTemporaryRenderContext()
-            if text_context:
-                painter.setRenderHint(QPainter.Antialiasing)
-                text_context.setPainter(painter)
-
-                font_metrics = QFontMetricsF(text_format.scaledFont(context))
-                y_baseline_v_center = (
-                    symbol_size.height()
-                    + font_metrics.ascent()
-                    - font_metrics.descent()
-                ) / 2
-
-                QgsTextRenderer.drawText(
-                    QPointF(symbol_size.width() / 2, y_baseline_v_center),
-                    0,
-                    QgsTextRenderer.AlignCenter,
-                    [text],
-                    text_context,
-                    text_format,
+        for parent, parent_rows in rows.values():
+            parent_rows = sorted(set(parent_rows))
+            first = last = parent_rows[0]
+            for row in parent_rows[1:] + [None]:
+                if row == last + 1:
+                    last = row
+                    continue
+                self.dataChanged.emit(
+                    self.index(first, 0, parent), self.index(last, 0, parent), roles
                 )
-                text_context.setPainter(None)
+                first = last = row
+
+    @contextmanager
+    def batch_update(self):
+        """ Context manager yielding a StyleBatch. The nodes styled through the
+        batch are refreshed once, when the outermost batch ends """
+        if self.batch is not None:
+            yield self.batch
+            return
 
-        except Exception as e:
-            QgsMessageLog.logMessage(str(e))
+        self.batch = StyleBatch(self.palette)
+        try:
+            yield self.batch
+        finally:
+            batch, self.batch = self.batch, None
+            self.flush_batch(batch)
 
-    return pixmap
+    def flush_batch(self, batch):
+        if not batch.nodes:
+            return
 
+        if batch.fonts_changed:
+            self.font_cache.clear()
+
+        indexes = []
+        for node in batch.nodes.values():
+            index = self.node2index(node)
+            self.decoration_cache.pop(index.internalId(), None)
+            indexes.append(index)
+
+        self.emit_data_changed(
+            indexes,
+            [Qt.DecorationRole, Qt.FontRole, Qt.ForegroundRole, Qt.BackgroundRole],
+        )
+        self.palette_timer.start()
+        QgsProject.instance().setDirty(True)
+
+    def load_palette(self):
+        """ Read the style palette of the project, and move the styles stored
+        on the nodes themselves by older versions to the palette """
+        project = QgsProject.instance()
+        aliases = self.palette.load(project)
+        changed = False
+        unknown = 0
+        for node in walk(self.rootGroup()):
+            changed = self.palette.resolve(node, aliases) or changed
+            changed = self.palette.migrate(node) or changed
+            unknown += self.palette.is_unknown(node)
+        if changed:
+            self.palette.prune(walk(self.rootGroup()))
+            self.palette.save(project)
+        style_registry.save()
+        if unknown:
+            QgsMessageLog.logMessage(
+                f"{unknown} layer tree nodes reference an unknown style",
+                "LayerTreeIcons",
+                Qgis.Warning,
+            )
+
+    def save_palette(self):
+        """ Drop the unused styles and write the palette in the project """
+        self.palette.prune(walk(self.rootGroup()))
+        self.palette.save(QgsProject.instance())
+        style_registry.save()
+
+    def on_project_read(self):
+        self.load_palette()
+        self.font_cache.clear()
+        self.clear_decoration_cache()
+        self.dataChanged.emit(QModelIndex(), QModelIndex())
+
+    def on_legend_changed(self, layer_id):
+        legend_pixmap_cache.invalidate_legend(layer_id)
+        self.on_layer_changed(layer_id)
+
+    def on_layer_style_changed(self, layer_id):
+        legend_pixmap_cache.invalidate(layer_id)
+        self.on_layer_changed(layer_id)
+
+    def on_layers_removed(self, layer_ids):
+        for layer_id in layer_ids:
+            legend_pixmap_cache.invalidate(layer_id)
+            self.scale_index.remove_layer(layer_id)
+            # The layer is deleted along with its connections
+            self.layer_connections.pop(layer_id, None)
+
+    def on_scale_range_changed(self, layer_id):
+        layer = QgsProject.instance().mapLayer(layer_id)
+        if layer and self.scale_index.update_layer(layer):
+            self.refresh_dimmed([layer_id])
+
+    def on_scale_changed(self, scale):
+        self.refresh_dimmed(self.scale_index.set_scale(scale))
+
+    def refresh_dimmed(self, layer_ids):
+        """ Repaint the text of the layers which got in or out of scale """
+        for layer_id in layer_ids:
+            for node in self.layer_nodes(layer_id):
+                index = self.node2index(node)
+                self.dataChanged.emit(index, index, [Qt.FontRole, Qt.ForegroundRole])
+
+    def is_dimmed(self, node):
+        """ Invisible or out of scale layers are displayed dimmed """
+        if not QgsLayerTree.isLayer(node):
+            return False
+        if self.scale_index.is_out_of_scale(node.layerId()):
+            return True
+        layer = node.layer()
+        return not node.isVisible() and (not layer or layer.isSpatial())
+
+    def on_custom_property_changed(self, node, key):
+        if key in PROPERTY_FIELDS:
+            # Style set by a script on the node itself
+            if self.palette.migrate(node):
+                self.palette_timer.start()
+        if key in (FONT_KEY, STYLE_KEY):
+            self.font_cache.clear()
+        self.invalidate_decoration(node)
+
+    def invalidate_decoration(self, node):
+        """ Drop the cached decoration of a node (and of its legend nodes) and
+        ask the view to repaint it """
+        index = self.node2index(node)
+        if not index.isValid():
+            return
 
-class CustomTreeModel(QgsLayerTreeModel):
-    """ Custom tree model which handles custom icons on nodes """
+        self.decoration_cache.pop(index.internalId(), None)
+        if QgsLayerTree.isLayer(node):
+            for legend_node in self.layerLegendNodes(node):
+                legend_index = self.legendNode2index(legend_node)
+                self.decoration_cache.pop(legend_index.internalId(), None)
+
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def icon_size(self):
+        icon_size = iface.layerTreeView().iconSize().width()
+        if icon_size == -1:
+            icon_size = 16
+        return icon_size
+
+    def icon_pixmap(self, path):
+        """ Return the icon at path, rasterized for the layer tree view """
+        return icon_cache.pixmap(
+            path, self.icon_size(), iface.layerTreeView().devicePixelRatioF()
+        )
+
+    def rasterize_category_icons(self):
+        """ Rasterize the default icon of every category at the current icon
+        size and device pixel ratio of the view """
+        view = iface.layerTreeView()
+        key = (self.icon_size(), view.devicePixelRatioF())
+        self.category_pixmaps = {
+            category: icon_cache.pixmap(path, *key)
+            for category, path in self.style.default_icons.items()
+        }
+        self.category_pixmaps_key = key
+
+    def category_pixmap(self, category):
+        """ Return the default icon of a category. All the category icons are
+        rasterized again at once when the icon size or the screen changed """
+        key = (self.icon_size(), iface.layerTreeView().devicePixelRatioF())
+        if key != self.category_pixmaps_key:
+            self.rasterize_category_icons()
+        return self.category_pixmaps[category]
+
+    def drop_decoration(self, index):
+        self.decoration_cache.pop(index.internalId(), None)
+
+    def refresh_decoration(self, index):
+        """ Rebuild the decoration of a single index """
+        self.drop_decoration(index)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def on_rows_about_to_be_removed(self, parent, first, last):
+        """ Drop the cached decorations of the removed rows and of their
+        children, legend rows included. Their internal ids may be reused by the
+        rows added later """
+        indexes = [self.index(row, 0, parent) for row in range(first, last + 1)]
+        while indexes:
+            index = indexes.pop()
+            self.drop_decoration(index)
+            self.lazy_indexes.pop(index.internalId(), None)
+            indexes.extend(
+                self.index(row, 0, index) for row in range(self.rowCount(index))
+            )
+
+    def clear_decoration_cache(self):
+        self.decoration_cache.clear()
+        self.overlay_cache.clear()
+        # The rows still displaying a lazy decoration must get their actual
+        # decoration when they are scrolled into view
+        self.lazy_indexes = {
+            internal_id: index
+            for internal_id, index in self.lazy_indexes.items()
+            if index.isValid()
+        }
+        self.viewport_tracker.schedule_update()
+
+    def on_viewport_changed(self):
+        """ Build the decoration of the rows which were scrolled into view """
+        for internal_id, index in list(self.lazy_indexes.items()):
+            if internal_id in self.viewport_tracker.hot:
+                del self.lazy_indexes[internal_id]
+                if index.isValid():
+                    self.refresh_decoration(QModelIndex(index))
+
+    def lazy_decoration(self, index):
+        """ Cheap decoration of the rows out of view: the default icon of the
+        node category, or a blank icon for legend nodes """
+        self.lazy_indexes[index.internalId()] = QPersistentModelIndex(index)
 
-    def __init__(self, parent=None):
-        super().__init__(QgsProject.instance().layerTreeRoot(), parent)
-        self.setFlags(iface.layerTreeView().layerTreeModel().flags())
-        self.settings = QSettings()
-        self.settings.beginGroup("plugins/layertreeicons")
+        node = self.index2node(index)
+        category = node_category(node) if node else None
+        if category:
+            return self.category_pixmap(category)
+
+        icon_size = self.icon_size()
+        return async_legend_renderer.placeholder(QSize(icon_size, icon_size))
+
+    def on_rows_inserted(self, parent, first, last):
+        """ Legend nodes inserted under a layer node: its legend was rebuilt """
+        node = self.index2node(parent)
+        if node and QgsLayerTree.isLayer(node):
+            legend_pixmap_cache.invalidate_legend(node.layerId())
+
+    def set_style(self, style):
+        """ Swap the style configuration and refresh the whole tree """
+        rules_changed = style.rules.source != self.style.rules.source
+        self.style = style
+        if rules_changed:
+            self.rule_styles.clear()
+            for node in walk(self.rootGroup()):
+                if node.parent() is not None:
+                    self.update_rule_style(node)
+        self.viewport_tracker.set_margin(style.prefetch_rows)
+        self.rasterize_category_icons()
+        self.clear_decoration_cache()
+        self.dataChanged.emit(QModelIndex(), QModelIndex())
+
+    def reload_settings(self):
+        """ Reload the style configuration from the plugins/layertreeicons
+        settings. Must be called after editing them directly, e.g.
+
+        QSettings().setValue("plugins/layertreeicons/defaulticons/group", path)
+        iface.layerTreeView().model().reload_settings()
+        """
+        style = StyleConfig.load()
+
+        f = QFont()
+        if f.fromString(style.group_font) and f.family():
+            self.setLayerTreeNodeFont(QgsLayerTree.NodeGroup, f)
+        f = QFont()
+        if f.fromString(style.layer_font) and f.family():
+            self.setLayerTreeNodeFont(QgsLayerTree.NodeLayer, f)
+
+        self.set_style(style)
+
+    def set_rules(self, rules):
+        """ Store a list of styling rules (see rules.py) and apply them """
+        QSettings().setValue("plugins/layertreeicons/rules", json.dumps(rules))
+        self.reload_settings()
 
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
             return
 
-        node = self.index2node(index)
-        legend_node = self.index2legendNode(index)
+        # Repaints only hit the decoration cache
+        if role == Qt.DecorationRole and index.column() == 0:
+            view = iface.layerTreeView()
+            key = (view.iconSize().width(), view.devicePixelRatioF())
+            node_cache = self.decoration_cache.get(index.internalId())
+            if node_cache and key in node_cache:
+                return self.with_edit_state(index, node_cache[key])
+
+            lazy = self.style.lazy_decorations
+            if lazy and not self.viewport_tracker.is_hot(index):
+                return self.with_edit_state(index, self.lazy_decoration(index))
+
+            decoration = self.decoration(index)
+            if decoration is None:
+                return super().data(index, role)
 
-        if legend_node and role == Qt.DecorationRole:
-            pixmap = pixmapForLegendNode(legend_node)
-            if pixmap:
-                return pixmap
+            self.decoration_cache.setdefault(index.internalId(), {})[key] = decoration
+            return self.with_edit_state(index, decoration)
+
+        node = self.index2node(index)
 
         if not node:
             return super().data(index, role)
 
         if role == Qt.FontRole:
-            f = iface.layerTreeView().font()
-
-            if node.customProperty("plugins/customTreeIcon/font"):
-                f.fromString(node.customProperty("plugins/customTreeIcon/font"))
+            source = None
+            node_style = self.palette.node_style(node)
+            if node_style.font:
+                source = node_style.font
+            elif self.rule_style(index).font:
+                source = self.rule_style(index).font
             elif QgsLayerTree.isLayer(node):
-                f = self.layerTreeNodeFont(QgsLayerTree.NodeLayer)
+                source = QgsLayerTree.NodeLayer
             elif QgsLayerTree.isGroup(node):
-                f = self.layerTreeNodeFont(QgsLayerTree.NodeGroup)
-
-            if index == self.currentIndex():
-                f.setUnderline(not f.underline())
+                source = QgsLayerTree.NodeGroup
 
-            if QgsLayerTree.isLayer(node):
-                _, _, scale = self.legendMapViewData()
-                layer = node.layer()
-                if (not node.isVisible() and (not layer or layer.isSpatial())) or (
-                    layer and not layer.isInScaleRange(scale)
-                ):
-                    f.setItalic(not f.italic())
+            current = index == self.currentIndex()
 
+            key = (source, current, self.is_dimmed(node))
+            f = self.font_cache.get(key)
+            if f is None:
+                f = self.build_font(*key)
+                self.font_cache[key] = f
             return f
 
         if role == Qt.ForegroundRole:
             color = None
-            if node.customProperty("plugins/customTreeIcon/textColor"):
-                color = QColor(node.customProperty("plugins/customTreeIcon/textColor"))
+            node_style = self.palette.node_style(node)
+            if node_style.text_color:
+                color = QColor(node_style.text_color)
+            elif self.rule_style(index).text_color is not None:
+                color = QColor(self.rule_style(index).text_color)
             elif QgsLayerTree.isGroup(node):
-                if self.settings.value("group_text_color"):
-                    color = QColor(self.settings.value("group_text_color"))
+                if self.style.group_text_color is not None:
+                    color = QColor(self.style.group_text_color)
             else:
-                if self.settings.value("layer_text_color"):
-                    color = QColor(self.settings.value("layer_text_color"))
+                if self.style.layer_text_color is not None:
+                    color = QColor(self.style.layer_text_color)
             if color:
-                if QgsLayerTree.isLayer(node):
-                    _, _, scale = self.legendMapViewData()
-                    layer = node.layer()
-                    if (not node.isVisible() and (not layer or layer.isSpatial())) or (
-                        layer and not layer.isInScaleRange(scale)
-                    ):
-                        color.setAlpha(128)
+                if self.is_dimmed(node):
+                    color.setAlpha(128)
                 return color
 
         if role == Qt.BackgroundRole:
-            if node.customProperty("plugins/customTreeIcon/backgroundColor"):
-                return QColor(
-                    node.customProperty("plugins/customTreeIcon/backgroundColor")
-                )
+            node_style = self.palette.node_style(node)
+            if node_style.background_color:
+                return QColor(node_style.background_color)
+            elif self.rule_style(index).background_color is not None:
+                return self.rule_style(index).background_color
             elif QgsLayerTree.isGroup(node):
-                if self.settings.value("group_background_color"):
-                    return QColor(self.settings.value("group_background_color"))
+                if self.style.group_background_color is not None:
+                    return self.style.group_background_color
             else:
-                if self.settings.value("layer_background_color"):
-                    return QColor(self.settings.value("layer_background_color"))
+                if self.style.layer_background_color is not None:
+                    return self.style.layer_background_color
 
-        # Override data for DecorationRole (Icon)
-        if role == Qt.DecorationRole and index.column() == 0:
-            icon = None
-            pixmap = None
+        # call QgsLayerTreeModel implementation
+        return super().data(index, role)
 
-            # If a custom icon was set for this node
-            if node.customProperty("plugins/customTreeIcon/icon"):
-                icon = QIcon(node.customProperty("plugins/customTreeIcon/icon"))
+    def embedded_legend_node(self, node):
+        """ Return the legend node embedded in a vector layer node, if any """
+        if (
+            QgsLayerTree.isLayer(node)
+            and isinstance(node.layer(), QgsVectorLayer)
+            and self.testFlag(QgsLayerTreeModel.ShowLegend)
+            and self.legendEmbeddedInParent(node)
+        ):
+            return self.legendNodeEmbeddedInParent(node)
+        return None
 
-            # If an icon was set for the node type
-            elif QgsLayerTree.isGroup(node):
-                if self.settings.value("defaulticons/group", ""):
-                    icon = QIcon(self.settings.value("defaulticons/group"))
-                else:
-                    icon = QIcon(":/images/themes/default/mActionFolder.svg")
+    def build_font(self, source, current, dimmed):
+        """ Build the font of a node from its custom font string, or from the
+        default font of its node type """
+        if isinstance(source, str):
+            f = iface.layerTreeView().font()
+            f.fromString(source)
+        elif source is not None:
+            f = self.layerTreeNodeFont(source)
+        else:
+            f = iface.layerTreeView().font()
 
-            elif QgsLayerTree.isLayer(node):
-                layer = node.layer()
-
-                if not layer:
-                    return super().data(index, role)
-
-                if layer.type() == QgsMapLayer.RasterLayer:
-                    if self.settings.value("defaulticons/raster", ""):
-                        icon = QIcon(self.settings.value("defaulticons/raster"))
-                    else:
-                        icon = QIcon(":/images/themes/default/mIconRaster.svg")
-
-                if layer.type() == QgsMapLayer.VectorLayer:
-
-                    if self.testFlag(
-                        QgsLayerTreeModel.ShowLegend
-                    ) and self.legendEmbeddedInParent(node):
-                        size = iface.layerTreeView().iconSize()
-
-                        legend_node = self.legendNodeEmbeddedInParent(node)
-                        pixmap = pixmapForLegendNode(legend_node)
-
-                    else:
-
-                        if layer.geometryType() == QgsWkbTypes.PointGeometry:
-                            if self.settings.value("defaulticons/point", ""):
-                                icon = QIcon(self.settings.value("defaulticons/point"))
-                            else:
-                                icon = QIcon(
-                                    ":/images/themes/default/mIconPointLayer.svg"
-                                )
-                        elif layer.geometryType() == QgsWkbTypes.LineGeometry:
-                            if self.settings.value("defaulticons/line", ""):
-                                icon = QIcon(self.settings.value("defaulticons/line"))
-                            else:
-                                icon = QIcon(
-                                    ":/images/themes/default/mIconLineLayer.svg"
-                                )
-                        elif layer.geometryType() == QgsWkbTypes.PolygonGeometry:
-                            if self.settings.value("defaulticons/polygon", ""):
-                                icon = QIcon(
-                                    self.settings.value("defaulticons/polygon")
-                                )
-                            else:
-                                icon = QIcon(
-                                    ":/images/themes/default/mIconPolygonLayer.svg"
-                                )
-                        elif layer.geometryType() == QgsWkbTypes.NullGeometry:
-                            if self.settings.value("defaulticons/nogeometry", ""):
-                                icon = QIcon(
-                                    self.settings.value("defaulticons/nogeometry")
-                                )
-                            else:
-                                icon = QIcon(
-                                    ":/images/themes/default/mIconTableLayer.svg"
-                                )
-
-                try:
-                    if layer.type() == QgsMapLayer.MeshLayer:
-                        if self.settings.value("defaulticons/mesh", ""):
-                            icon = QIcon(self.settings.value("defaulticons/mesh"))
-                        else:
-                            icon = QIcon(":/images/themes/default/mIconMeshLayer.svg")
-
-                except AttributeError:
-                    pass
-
-            # Special case: In-edition vector layer. Draw an editing icon over
-            # the custom icon. Adapted from QGIS source code (qgslayertreemodel.cpp)
-            if (pixmap or icon) and QgsLayerTree.isLayer(node):
-                layer = node.layer()
-                if layer and isinstance(layer, QgsVectorLayer) and layer.isEditable():
-                    icon_size = iface.layerTreeView().iconSize().width()
-                    if icon_size == -1:
-                        icon_size = 16
-                    if not pixmap and icon:
-                        pixmap = QPixmap(icon.pixmap(icon_size, icon_size))
-                    painter = QPainter(pixmap)
-                    painter.drawPixmap(
-                        0,
-                        0,
-                        icon_size,
-                        icon_size,
-                        QgsApplication.getThemeIcon(
-                            ("/mIconEditableEdits.svg")
-                            if layer.isModified()
-                            else ("/mActionToggleEditing.svg")
-                        ).pixmap(icon_size, icon_size),
-                    )
-                    painter.end()
-                    del painter
-
-            if pixmap:
-                return pixmap
-            if icon:
-                return icon
+        if current:
+            f.setUnderline(not f.underline())
+        if dimmed:
+            f.setItalic(not f.italic())
+        return f
 
-        # call QgsLayerTreeModel implementation
-        return super().data(index, role)
+    def setLayerTreeNodeFont(self, node_type, font):
+        super().setLayerTreeNodeFont(node_type, font)
+        self.font_cache.clear()
+
+    def decoration(self, index):
+        """ Build the icon of a node, or None to fall back on the default
+        QgsLayerTreeModel implementation """
+        legend_node = self.index2legendNode(index)
+        if legend_node:
+            return pixmapForLegendNode(legend_node, index)
+
+        node = self.index2node(index)
+        if not node:
+            return
+
+        pixmap = None
+
+        # If a custom icon was set for this node
+        node_style = self.palette.node_style(node)
+        if node_style.icon:
+            pixmap = self.icon_pixmap(node_style.icon)
+
+        elif QgsLayerTree.isLayer(node) and not node.layer():
+            return
+
+        # If a rule sets the icon of this node
+        elif self.rule_style(index).icon:
+            pixmap = self.icon_pixmap(self.rule_style(index).icon)
+
+        else:
+            legend_node = self.embedded_legend_node(node)
+            category = node_category(node)
+
+            # Embedded legend node: use the symbol as icon
+            if legend_node:
+                pixmap = pixmapForLegendNode(legend_node, index)
+
+            # If an icon was set for the node type
+            elif category:
+                pixmap = self.category_pixmap(category)
+
+        return pixmap
@@ -2,8 +2,8 @@
 
 from functools import partial
 
-from PyQt5.QtCore import QSettings, QSize, QModelIndex
-from PyQt5.QtGui import QIcon, QFont, QColor
+from PyQt5.QtCore import QSettings, QSize
+from PyQt5.QtGui import QFont, QColor
 from PyQt5.QtWidgets import (
     QDialog,
     QToolButton,
@@ -23,6 +23,8 @@ from qgis.utils import iface
 
 from .resourcebrowserimpl import ResourceBrowser
 from .colorfontdialog import ColorFontDialog
+from .iconcache import icon_cache
+from .styleconfig import DEFAULT_ICONS
 
 
 class DefaultIconsDialog(QDialog):
@@ -79,29 +81,18 @@ class DefaultIconsDialog(QDialog):
 
         self.reset_button.clicked.connect(self.reset_all)
 
-        self.resource_browser = ResourceBrowser(parent)
-
         self.source_data = {
-            "group": (self.tr("Group"), ":/images/themes/default/mActionFolder.svg",),
-            "raster": (self.tr("Raster"), ":/images/themes/default/mIconRaster.svg",),
-            "point": (self.tr("Point"), ":/images/themes/default/mIconPointLayer.svg",),
-            "line": (self.tr("Line"), ":/images/themes/default/mIconLineLayer.svg",),
-            "polygon": (
-                self.tr("Polygon"),
-                ":/images/themes/default/mIconPolygonLayer.svg",
-            ),
-            "nogeometry": (
-                self.tr("No Geometry"),
-                ":/images/themes/default/mIconTableLayer.svg",
-            ),
+            "group": (self.tr("Group"), DEFAULT_ICONS["group"]),
+            "raster": (self.tr("Raster"), DEFAULT_ICONS["raster"]),
+            "point": (self.tr("Point"), DEFAULT_ICONS["point"]),
+            "line": (self.tr("Line"), DEFAULT_ICONS["line"]),
+            "polygon": (self.tr("Polygon"), DEFAULT_ICONS["polygon"]),
+            "nogeometry": (self.tr("No Geometry"), DEFAULT_ICONS["nogeometry"]),
         }
 
         if Qgis.QGIS_VERSION_INT > 30200:
 
-            self.source_data["mesh"] = (
-                self.tr("Mesh Layer"),
-                ":/images/themes/default/mIconMeshLayer.svg",
-            )
+            self.source_data["mesh"] = (self.tr("Mesh Layer"), DEFAULT_ICONS["mesh"])
 
         for settings_key, (text, default_icon) in self.source_data.items():
 
@@ -109,7 +100,7 @@ class DefaultIconsDialog(QDialog):
             button.setObjectName(settings_key)
             button.setPopupMode(QToolButton.MenuButtonPopup)
             button.setIconSize(QSize(24, 24))
-            button.setIcon(QIcon(default_icon))
+            button.setIcon(self.button_icon(default_icon))
             label = QLabel(text, self)
             label.setMinimumSize(QSize(label.minimumSize().width(), 38))
             self.form_layout.addRow(label, button)
@@ -131,42 +122,35 @@ class DefaultIconsDialog(QDialog):
             action_reset.triggered.connect(partial(self.reset, settings_key))
             button.addAction(action_reset)
 
+        # Fill missing fonts with the layer tree view defaults
         f = QFont()
-        if f.fromString(self.settings.value("group_font")) and f.family():
-            iface.layerTreeView().model().setLayerTreeNodeFont(
-                QgsLayerTree.NodeGroup, f
-            )
-        else:
-            iface.layerTreeView().model().setLayerTreeNodeFont(
-                QgsLayerTree.NodeGroup, iface.layerTreeView().font()
-            )
+        if not (f.fromString(self.settings.value("group_font")) and f.family()):
             self.settings.setValue(
                 "group_font", iface.layerTreeView().font().toString()
             )
 
         f = QFont()
-        if f.fromString(self.settings.value("layer_font")) and f.family():
-            iface.layerTreeView().model().setLayerTreeNodeFont(
-                QgsLayerTree.NodeLayer, f
-            )
-        else:
+        if not (f.fromString(self.settings.value("layer_font")) and f.family()):
             f = iface.layerTreeView().font()
             f.setBold(True)
-            iface.layerTreeView().model().setLayerTreeNodeFont(
-                QgsLayerTree.NodeLayer, f
-            )
             self.settings.setValue("layer_font", f.toString())
+
+        iface.layerTreeView().model().reload_settings()
         self.update_font_labels()
 
+    def button_icon(self, path):
+        return icon_cache.icon(path, 24, self.devicePixelRatioF())
+
     def set_icon_from_ressources(self, settings_key):
-        res = self.resource_browser.exec()
+        resource_browser = ResourceBrowser.shared()
+        res = resource_browser.exec()
         if res == QDialog.Accepted:
             button = self.findChild(QToolButton, settings_key)
-            button.setIcon(QIcon(self.resource_browser.icon))
+            button.setIcon(self.button_icon(resource_browser.icon))
             self.settings.setValue(
-                f"defaulticons/{settings_key}", self.resource_browser.icon
+                f"defaulticons/{settings_key}", resource_browser.icon
             )
-        iface.layerTreeView().model().dataChanged.emit(QModelIndex(), QModelIndex())
+            iface.layerTreeView().model().refresh_category(settings_key)
 
     def set_icon_from_file(self, settings_key):
 
@@ -179,21 +163,23 @@ class DefaultIconsDialog(QDialog):
         if not icon:
             return
 
+        # The file may have been edited since it was last displayed
+        icon_cache.invalidate(icon)
         button = self.findChild(QToolButton, settings_key)
-        button.setIcon(QIcon(icon))
+        button.setIcon(self.button_icon(icon))
         self.settings.setValue(f"defaulticons/{settings_key}", icon)
-        iface.layerTreeView().model().dataChanged.emit(QModelIndex(), QModelIndex())
+        iface.layerTreeView().model().refresh_category(settings_key)
 
     def reset(self, settings_key):
         button = self.findChild(QToolButton, settings_key)
-        button.setIcon(QIcon(self.source_data[settings_key][1]))
+        button.setIcon(self.button_icon(self.source_data[settings_key][1]))
         self.settings.setValue(f"defaulticons/{settings_key}", "")
-        iface.layerTreeView().model().dataChanged.emit(QModelIndex(), QModelIndex())
+        iface.layerTreeView().model().refresh_category(settings_key)
 
     def reset_all(self):
         for settings_key, (_, default_icon) in self.source_data.items():
             button = self.findChild(QToolButton, settings_key)
-            button.setIcon(QIcon(default_icon))
+            button.setIcon(self.button_icon(default_icon))
             self.settings.setValue(f"defaulticons/{settings_key}", "")
 
         f = iface.layerTreeView().font()
@@ -202,20 +188,17 @@ class DefaultIconsDialog(QDialog):
         self.settings.setValue(f"group_background_color", "")
         f.setBold(True)
         self.settings.setValue(f"layer_font", f.toString())
-        f = iface.layerTreeView().font()
-        iface.layerTreeView().model().setLayerTreeNodeFont(QgsLayerTree.NodeGroup, f)
-        f.setBold(True)
-        iface.layerTreeView().model().setLayerTreeNodeFont(QgsLayerTree.NodeLayer, f)
         self.settings.setValue(f"layer_text_color", "")
         self.settings.setValue(f"layer_background_color", "")
+        iface.layerTreeView().model().reload_settings()
         self.update_font_labels()
-        iface.layerTreeView().model().dataChanged.emit(QModelIndex(), QModelIndex())
         self.icon_size_combo.setCurrentIndex(0)
 
     def on_icon_size_changed(self):
         val = self.icon_size_combo.currentData()
         iface.layerTreeView().setIconSize(QSize(val, val))
         self.settings.setValue("iconsize", val)
+        iface.layerTreeView().model().reload_settings()
 
     def select_group_font(self):
 
@@ -235,14 +218,12 @@ class DefaultIconsDialog(QDialog):
         if res != QDialog.Accepted:
             return
 
-        iface.layerTreeView().model().setLayerTreeNodeFont(
-            QgsLayerTree.NodeGroup, dialog.currentFont()
-        )
         self.settings.setValue(f"group_font", dialog.currentFont().toString())
         self.settings.setValue("group_text_color", dialog.textColor().name())
         self.settings.setValue(
             "group_background_color", dialog.backgroundColor().name()
         )
+        iface.layerTreeView().model().reload_settings()
         self.update_font_labels()
         dialog.deleteLater()
 
@@ -266,14 +247,12 @@ class DefaultIconsDialog(QDialog):
         if res != QDialog.Accepted:
             return
 
-        iface.layerTreeView().model().setLayerTreeNodeFont(
-            QgsLayerTree.NodeLayer, dialog.currentFont()
-        )
         self.settings.setValue(f"layer_font", dialog.currentFont().toString())
         self.settings.setValue("layer_text_color", dialog.textColor().name())
         self.settings.setValue(
             "layer_background_color", dialog.backgroundColor().name()
         )
+        iface.layerTreeView().model().reload_settings()
         self.update_font_labels()
         dialog.deleteLater()
 
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+""" Process-wide cache of rasterized icons
+
+Custom icons are file paths or Qt resource paths. Loading them means a stat and,
+for SVG files, a parse and a rasterization. The pixmaps are shared here between
+the layer tree model, the default icons dialog and the resource browser so that
+an icon used by hundreds of layers is only rasterized once per size.
+"""
+
+import os
+from collections import OrderedDict
+from time import monotonic
+
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QIcon, QImageReader, QPixmap
+
+
+# Default memory budget of the cache, in bytes
+DEFAULT_BUDGET = 32 * 1024 * 1024
+
+# Delay after which the modification time of an icon file is checked again, in
+# seconds
+MTIME_TTL = 5.0
+
+
+def file_mtime(path):
+    """ Modification time of an icon file. Qt resources never change """
+    if path.startswith(":") or path.startswith("qrc:"):
+        return 0
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+def rasterize(path, size, device_pixel_ratio=1.0):
+    """ Render the image at path in a size x size (device independent pixels)
+    square, keeping its aspect ratio. Returns a QImage, which unlike QPixmap can
+    safely be created outside of the GUI thread """
+    pixel_size = round(size * device_pixel_ratio)
+    reader = QImageReader(path)
+    if reader.size().isValid():
+        reader.setScaledSize(
+            reader.size().scaled(pixel_size, pixel_size, Qt.KeepAspectRatio)
+        )
+    else:
+        reader.setScaledSize(QSize(pixel_size, pixel_size))
+    image = reader.read()
+    if not image.isNull():
+        image.setDevicePixelRatio(device_pixel_ratio)
+    return image
+
+
+class IconCache:
+    """ LRU cache of pixmaps keyed by path, file mtime, size and device pixel
+    ratio, bounded by a memory budget.
+
+    The file mtimes are cached too, so that cache hits do not touch the
+    filesystem: an icon file edited on disk is reloaded at most MTIME_TTL
+    seconds later, or after invalidate() """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        # {path: (mtime, time it was read)}
+        self.mtimes = {}
+        self.cost = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def mtime(self, path):
+        """ Modification time of an icon file, read at most every MTIME_TTL
+        seconds """
+        now = monotonic()
+        cached = self.mtimes.get(path)
+        if cached is not None and now - cached[1] < MTIME_TTL:
+            return cached[0]
+        mtime = file_mtime(path)
+        self.mtimes[path] = (mtime, now)
+        return mtime
+
+    def invalidate(self, path=None):
+        """ Check the modification time of an icon file (or of all the files)
+        on the next lookup """
+        if path is None:
+            self.mtimes.clear()
+        else:
+            self.mtimes.pop(path, None)
+
+    def key(self, path, size, device_pixel_ratio=1.0):
+        return (path, self.mtime(path), size, device_pixel_ratio)
+
+    def get(self, path, size, device_pixel_ratio=1.0):
+        """ Return the cached pixmap of the icon at path, or None """
+        key = self.key(path, size, device_pixel_ratio)
+        pixmap = self.entries.get(key)
+        if pixmap is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return pixmap
+
+    def pixmap(self, path, size, device_pixel_ratio=1.0):
+        """ Return the icon at path rasterized at the given size """
+        pixmap = self.get(path, size, device_pixel_ratio)
+        if pixmap is not None:
+            return pixmap
+
+        self.misses += 1
+        image = rasterize(path, size, device_pixel_ratio)
+        return self.insert_image(path, size, device_pixel_ratio, image)
+
+    def insert_image(self, path, size, device_pixel_ratio, image):
+        """ Cache the icon at path rasterized in image (see rasterize), and
+        return its pixmap. Must be called from the GUI thread """
+        if image.isNull():
+            # Unsupported format: let QIcon pick an icon engine
+            pixmap = QIcon(path).pixmap(QSize(size, size))
+        else:
+            pixmap = QPixmap.fromImage(image)
+        self.insert(self.key(path, size, device_pixel_ratio), pixmap)
+        return pixmap
+
+    def icon(self, path, size, device_pixel_ratio=1.0):
+        """ Return a QIcon built from the cached pixmap """
+        return QIcon(self.pixmap(path, size, device_pixel_ratio))
+
+    def insert(self, key, pixmap):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.cost -= self.pixmap_cost(previous)
+        self.entries[key] = pixmap
+        self.cost += self.pixmap_cost(pixmap)
+        self.evict()
+
+    def evict(self):
+        """ Drop the least recently used pixmaps until the budget is met """
+        while self.cost > self.budget and len(self.entries) > 1:
+            _, pixmap = self.entries.popitem(last=False)
+            self.cost -= self.pixmap_cost(pixmap)
+            self.evictions += 1
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.mtimes.clear()
+        self.cost = 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "cost": self.cost,
+            "budget": self.budget,
+        }
+
+    @staticmethod
+    def pixmap_cost(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+# Shared instance
+icon_cache = IconCache()
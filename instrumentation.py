@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+""" Optional timing of the layer tree hot paths
+
+When enabled, the instrumented functions are replaced by wrappers recording
+their call count and durations. When disabled, the original functions are
+restored: the instrumentation costs nothing.
+
+The durations are inclusive: the time spent building a decoration includes the
+time spent rendering its legend symbol.
+
+Some functions also run in the legend rendering threads: the statistics are
+guarded by a lock.
+"""
+
+import json
+import threading
+from collections import deque
+from functools import wraps
+from time import perf_counter
+
+from PyQt5.QtCore import Qt
+
+from . import customtreemodel, legendpixmap
+from .iconcache import icon_cache
+
+
+ROLE_NAMES = {
+    Qt.DisplayRole: "display",
+    Qt.DecorationRole: "decoration",
+    Qt.EditRole: "edit",
+    Qt.ToolTipRole: "tooltip",
+    Qt.FontRole: "font",
+    Qt.ForegroundRole: "foreground",
+    Qt.BackgroundRole: "background",
+    Qt.CheckStateRole: "checkstate",
+    Qt.SizeHintRole: "sizehint",
+}
+
+MAIN_THREAD = threading.main_thread()
+
+# Instrumented functions: (owner, attribute, label)
+TARGETS = (
+    (customtreemodel.CustomTreeModel, "decoration", "decoration/build"),
+    (customtreemodel.CustomTreeModel, "lazy_decoration", "decoration/lazy"),
+    (customtreemodel.CustomTreeModel, "with_edit_state", "decoration/edit_state"),
+    (customtreemodel.CustomTreeModel, "icon_pixmap", "decoration/icon"),
+    (customtreemodel.CustomTreeModel, "build_font", "font/build"),
+    (customtreemodel, "pixmapForLegendNode", "legend/pixmap"),
+    (legendpixmap, "renderLegendPixmap", "legend/render"),
+    (legendpixmap, "drawTextOnSymbol", "legend/text"),
+)
+
+
+class Statistic:
+    """ Call count, cumulative time and most recent durations of a function """
+
+    # Number of durations kept to compute the percentiles
+    SAMPLES = 10000
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=self.SAMPLES)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.samples.append(duration)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0,
+            "p95_us": samples[int(len(samples) * 0.95)] * 1e6 if samples else 0,
+        }
+
+
+class Instrumentation:
+    """ Record the durations of CustomTreeModel.data (per role) and of the
+    functions in TARGETS """
+
+    def __init__(self):
+        self.enabled = False
+        self.statistics = {}
+        # Original functions: {(owner, attribute): function}
+        self.originals = {}
+        # When set, durations are summed per label in this dict instead of
+        # being added to the statistics (see profiler.py)
+        self.capture = None
+        # Guards statistics and capture
+        self.lock = threading.Lock()
+
+    def record(self, label, duration):
+        with self.lock:
+            # Only the calls of the profiled node, in the GUI thread, are captured
+            capture = self.capture
+            if capture is not None and threading.current_thread() is MAIN_THREAD:
+                capture[label] = capture.get(label, 0) + duration
+                return
+            statistic = self.statistics.get(label)
+            if statistic is None:
+                statistic = self.statistics[label] = Statistic()
+            statistic.add(duration)
+
+    def timed(self, function, label):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(label, perf_counter() - start)
+
+        return wrapper
+
+    def timed_data(self, function):
+        @wraps(function)
+        def data(model, index, role=Qt.DisplayRole):
+            start = perf_counter()
+            try:
+                return function(model, index, role)
+            finally:
+                label = ROLE_NAMES.get(role) or f"role {int(role)}"
+                self.record(f"data/{label}", perf_counter() - start)
+
+        return data
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+
+        if enabled:
+            model_class = customtreemodel.CustomTreeModel
+            self.originals[(model_class, "data")] = model_class.data
+            model_class.data = self.timed_data(model_class.data)
+            for owner, attribute, label in TARGETS:
+                function = getattr(owner, attribute)
+                self.originals[(owner, attribute)] = function
+                setattr(owner, attribute, self.timed(function, label))
+        else:
+            for (owner, attribute), function in self.originals.items():
+                setattr(owner, attribute, function)
+            self.originals.clear()
+
+    def reset(self):
+        with self.lock:
+            self.statistics.clear()
+        icon_cache.reset_stats()
+
+    @staticmethod
+    def hit_rate(timings, calls, misses):
+        """ Cache hit rate deduced from the number of calls and of cache misses
+        (i.e. calls to the function which fills the cache) """
+        calls = timings.get(calls)
+        if not calls or not calls["count"]:
+            return None
+        misses = sum(timings[label]["count"] for label in misses if label in timings)
+        return max(0.0, 1 - misses / calls["count"])
+
+    def report(self):
+        """ Return the statistics as a JSON serializable dict """
+        with self.lock:
+            timings = {
+                label: statistic.summary()
+                for label, statistic in sorted(self.statistics.items())
+            }
+        icon_calls = icon_cache.hits + icon_cache.misses
+        return {
+            "enabled": self.enabled,
+            "timings": timings,
+            "caches": {
+                "decoration": self.hit_rate(
+                    timings, "data/decoration", ("decoration/build", "decoration/lazy")
+                ),
+                "font": self.hit_rate(timings, "data/font", ("font/build",)),
+                "legend": self.hit_rate(
+                    timings, "legend/pixmap", ("legend/render",)
+                ),
+                "icon": icon_cache.hits / icon_calls if icon_calls else None,
+            },
+            "icon_cache": icon_cache.stats(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+
+instrumentation = Instrumentation()
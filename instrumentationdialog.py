@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QSettings, QSize, Qt
+from PyQt5.QtWidgets import (
+    QDialog,
+    QCheckBox,
+    QLabel,
+    QVBoxLayout,
+    QHBoxLayout,
+    QPushButton,
+    QFileDialog,
+    QTableWidget,
+    QTableWidgetItem,
+    QHeaderView,
+)
+
+from .instrumentation import instrumentation
+
+
+class InstrumentationDialog(QDialog):
+    """ Display, export and reset the timings of the layer tree hot paths """
+
+    COLUMNS = ("count", "total_ms", "mean_us", "p95_us")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.settings = QSettings()
+        self.settings.beginGroup("plugins/layertreeicons")
+
+        self.setWindowTitle(self.tr("Layer tree performance"))
+        self.setMinimumSize(QSize(560, 400))
+        layout = QVBoxLayout(self)
+
+        self.enabled_checkbox = QCheckBox(self.tr("Record timings"), self)
+        self.enabled_checkbox.setChecked(instrumentation.enabled)
+        self.enabled_checkbox.toggled.connect(self.set_enabled)
+        layout.addWidget(self.enabled_checkbox)
+
+        self.table = QTableWidget(self)
+        self.table.setColumnCount(len(self.COLUMNS) + 1)
+        self.table.setHorizontalHeaderLabels(
+            [
+                self.tr("Function"),
+                self.tr("Calls"),
+                self.tr("Total (ms)"),
+                self.tr("Mean (µs)"),
+                self.tr("p95 (µs)"),
+            ]
+        )
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+        layout.addWidget(self.table)
+
+        self.caches_label = QLabel(self)
+        layout.addWidget(self.caches_label)
+
+        hlayout = QHBoxLayout()
+        refresh_button = QPushButton(self.tr("Refresh"), self)
+        refresh_button.clicked.connect(self.refresh)
+        hlayout.addWidget(refresh_button)
+        reset_button = QPushButton(self.tr("Reset"), self)
+        reset_button.clicked.connect(self.reset)
+        hlayout.addWidget(reset_button)
+        export_button = QPushButton(self.tr("Export JSON"), self)
+        export_button.clicked.connect(self.export)
+        hlayout.addWidget(export_button)
+        hlayout.addStretch()
+        close_button = QPushButton(self.tr("Close"), self)
+        close_button.clicked.connect(self.close)
+        hlayout.addWidget(close_button)
+        layout.addLayout(hlayout)
+
+    def showEvent(self, event):
+        self.refresh()
+        super().showEvent(event)
+
+    def set_enabled(self, enabled):
+        instrumentation.set_enabled(enabled)
+        self.settings.setValue("instrumentation", enabled)
+
+    def refresh(self):
+        report = instrumentation.report()
+
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(len(report["timings"]))
+        for row, (label, summary) in enumerate(report["timings"].items()):
+            self.table.setItem(row, 0, QTableWidgetItem(label))
+            for column, key in enumerate(self.COLUMNS, 1):
+                item = QTableWidgetItem()
+                # Numeric data, so that the columns sort numerically
+                value = summary[key]
+                if key != "count":
+                    value = round(value, 1)
+                item.setData(Qt.DisplayRole, value)
+                self.table.setItem(row, column, item)
+        self.table.setSortingEnabled(True)
+
+        rates = []
+        for cache, rate in report["caches"].items():
+            text = "-" if rate is None else f"{rate:.1%}"
+            rates.append(f"{cache}: {text}")
+        self.caches_label.setText(self.tr("Cache hit rates: ") + ", ".join(rates))
+
+    def reset(self):
+        instrumentation.reset()
+        self.refresh()
+
+    def export(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self,
+            caption=self.tr("Export statistics"),
+            filter=self.tr("JSON files (*.json)"),
+        )
+        if not filename:
+            return
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(instrumentation.to_json())
@@ -27,6 +27,7 @@ from PyQt5.QtCore import QSettings, QTranslator, QCoreApplication, QSize
 from PyQt5.QtGui import QIcon, QFont
 from PyQt5.QtWidgets import (
     QAction,
+    QFileDialog,
     QMessageBox,
     QWidget,
     QToolBar,
@@ -39,9 +40,18 @@ from .resources import *
 
 from .defaulticonsdialog import DefaultIconsDialog
 from .customtreemodel import CustomTreeModel
+from .iconcache import icon_cache, DEFAULT_BUDGET
+from .legendpixmap import render_context_cache, async_legend_renderer
 
 from .layertreecontextmenumanager import LayerTreeContextMenuManager
 from .menuprovider import LayerTreeMenuProvider
+from .resourcebrowserimpl import ResourceBrowser
+from .resourceindex import resource_index
+from .timing import startup_timer
+from .instrumentation import instrumentation
+from .instrumentationdialog import InstrumentationDialog
+from .profilerdialog import ProfilerDialog
+from .styleio import export_styles, import_styles
 
 
 class LayerTreeIcons:
@@ -91,6 +101,10 @@ class LayerTreeIcons:
         elif not isinstance(layer_font, str):
             self.settings.setValue("layer_font", "")
 
+        # Memory budget of the shared icon cache, in MB
+        budget = self.settings.value("icon_cache_size", DEFAULT_BUDGET >> 20, int)
+        icon_cache.set_budget(budget << 20)
+
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
         """Get the translation for a string using Qt translation API.
@@ -108,6 +122,7 @@ class LayerTreeIcons:
 
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
+        startup_timer.start()
 
         self.manage_default_action = QAction(
             QIcon(":/plugins/layertreeicons/icon.svg"),
@@ -120,21 +135,48 @@ class LayerTreeIcons:
             parent=self.iface.mainWindow(),
         )
         self.about_action.triggered.connect(self.show_about)
+        self.instrumentation_action = QAction(
+            self.tr("Layer Tree Performance"), parent=self.iface.mainWindow()
+        )
+        self.instrumentation_action.triggered.connect(self.show_instrumentation_dialog)
+        self.profile_action = QAction(
+            self.tr("Profile Layer Tree"), parent=self.iface.mainWindow()
+        )
+        self.profile_action.triggered.connect(self.show_profiler_dialog)
+        self.export_styles_action = QAction(
+            self.tr("Export Layer Tree Styles..."), parent=self.iface.mainWindow()
+        )
+        self.export_styles_action.triggered.connect(self.export_styles)
+        self.import_styles_action = QAction(
+            self.tr("Import Layer Tree Styles..."), parent=self.iface.mainWindow()
+        )
+        self.import_styles_action.triggered.connect(self.import_styles)
 
         self.plugin_menu = self.iface.pluginMenu().addMenu(
             QIcon(":/plugins/layertreeicons/icon.svg"), "LayerTreeIcons"
         )
         self.plugin_menu.addAction(self.manage_default_action)
+        self.plugin_menu.addAction(self.export_styles_action)
+        self.plugin_menu.addAction(self.import_styles_action)
+        self.plugin_menu.addAction(self.instrumentation_action)
+        self.plugin_menu.addAction(self.profile_action)
         self.plugin_menu.addAction(self.about_action)
+        startup_timer.mark("actions")
 
         # Replace the default QgsLayerTreeModel with our custom model
         self.custom_model = CustomTreeModel()
+        self.custom_model.reload_settings()
+        startup_timer.mark("model")
+
         self.contextMenuManager = LayerTreeContextMenuManager()
         self.contextMenuManager.addProvider(LayerTreeMenuProvider())
+        startup_timer.mark("context menu")
+
         self.iface.layerTreeView().setModel(self.custom_model)
 
-        icon_size = self.settings.value("iconsize", -1, int)
+        icon_size = self.custom_model.style.icon_size
         self.iface.layerTreeView().setIconSize(QSize(icon_size, icon_size))
+        startup_timer.mark("view")
 
         # Add the action to the QGIS Layer Panel toolbar
         self.layer_tree_toolbar = (
@@ -144,21 +186,95 @@ class LayerTreeIcons:
             self.separator = self.layer_tree_toolbar.addSeparator()
             self.layer_tree_toolbar.addAction(self.manage_default_action)
 
-        self.default_icons_dialog = DefaultIconsDialog(self.iface.mainWindow())
-        self.manage_default_action.triggered.connect(self.default_icons_dialog.show)
+        # The dialogs are built the first time they are opened
+        self.default_icons_dialog = None
+        self.instrumentation_dialog = None
+        self.profiler_dialog = None
+        instrumentation.set_enabled(self.settings.value("instrumentation", False, bool))
+        self.manage_default_action.triggered.connect(self.show_default_icons_dialog)
+        startup_timer.mark("toolbar")
+        startup_timer.report()
 
     def unload(self):
         """Removes the plugin menu item and icon from QGIS GUI."""
         self.iface.pluginMenu().removeAction(self.plugin_menu.menuAction())
         self.iface.layerTreeView().setModel(self.original_layer_tree_model)
         self.original_layer_tree_model.blockSignals(False)
-        self.default_icons_dialog.deleteLater()
+        self.custom_model.teardown()
+        self.custom_model.deleteLater()
+        if self.default_icons_dialog:
+            self.default_icons_dialog.deleteLater()
+        if self.instrumentation_dialog:
+            self.instrumentation_dialog.deleteLater()
+        if self.profiler_dialog:
+            self.profiler_dialog.deleteLater()
+        instrumentation.set_enabled(False)
+        ResourceBrowser.release()
+        resource_index.save()
+        async_legend_renderer.cancel_all()
+        render_context_cache.detach()
         self.iface.layerTreeView().setIconSize(QSize(-1, -1))
 
         if self.layer_tree_toolbar:
             self.layer_tree_toolbar.removeAction(self.manage_default_action)
             self.layer_tree_toolbar.removeAction(self.separator)
 
+    def show_default_icons_dialog(self):
+        if self.default_icons_dialog is None:
+            self.default_icons_dialog = DefaultIconsDialog(self.iface.mainWindow())
+        self.default_icons_dialog.show()
+
+    def show_instrumentation_dialog(self):
+        if self.instrumentation_dialog is None:
+            self.instrumentation_dialog = InstrumentationDialog(self.iface.mainWindow())
+        self.instrumentation_dialog.show()
+
+    def show_profiler_dialog(self):
+        if self.profiler_dialog is None:
+            self.profiler_dialog = ProfilerDialog(self.iface.mainWindow())
+        self.profiler_dialog.show()
+        self.profiler_dialog.run()
+
+    def export_styles(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(),
+            caption=self.tr("Export layer tree styles"),
+            filter=self.tr("Layer tree styles (*.ndjson)"),
+        )
+        if not filename:
+            return
+        try:
+            count = export_styles(filename, self.custom_model)
+        except OSError as e:
+            self.iface.messageBar().pushCritical("LayerTreeIcons", str(e))
+            return
+        self.iface.messageBar().pushSuccess(
+            "LayerTreeIcons", self.tr("{0} node styles exported").format(count)
+        )
+
+    def import_styles(self):
+        filename, _ = QFileDialog.getOpenFileName(
+            self.iface.mainWindow(),
+            caption=self.tr("Import layer tree styles"),
+            filter=self.tr("Layer tree styles (*.ndjson *.jsonl);;All files (*)"),
+        )
+        if not filename:
+            return
+        try:
+            styled, unmatched = import_styles(filename, self.custom_model)
+        except (OSError, ValueError) as e:
+            self.iface.messageBar().pushCritical("LayerTreeIcons", str(e))
+            return
+        message = self.tr("{0} node styles imported").format(styled)
+        if unmatched:
+            message += self.tr(", {0} nodes not found").format(unmatched)
+        self.iface.messageBar().pushSuccess("LayerTreeIcons", message)
+
+    def batch_style(self):
+        """ Context manager to style any number of nodes with a single refresh
+        of the layer tree, see CustomTreeModel.batch_update """
+        return self.custom_model.batch_update()
+
     def show_about(self):
 
         # Used to display plugin icon in the about message box
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+""" Legend symbol icons, rendered at the layer tree icon size """
+
+from PyQt5.QtCore import (
+    QObject,
+    QRunnable,
+    QThreadPool,
+    QPersistentModelIndex,
+    QModelIndex,
+    QSize,
+    QPointF,
+    Qt,
+    pyqtSignal,
+)
+from PyQt5.QtGui import QPainter, QFontMetricsF, QImage, QPixmap
+
+from qgis.core import (
+    QgsSymbolLegendNode,
+    QgsSymbolLayerUtils,
+    QgsTextFormat,
+    QgsTextRenderer,
+    QgsRenderContext,
+    qgsDoubleNear,
+    QgsMapToPixel,
+)
+from qgis.utils import iface, QgsMessageLog
+
+
+class LegendPixmapCache:
+    """ Rendered legend symbols, grouped by layer id so that they can be dropped
+    when the layer renderer or style changes.
+
+    Also holds the minimum icon width of each layer legend, which only changes
+    when the legend is rebuilt """
+
+    def __init__(self):
+        self.layers = {}
+        self.minimum_widths = {}
+
+    def get(self, layer_id, key):
+        return self.layers.get(layer_id, {}).get(key)
+
+    def insert(self, layer_id, key, pixmap):
+        self.layers.setdefault(layer_id, {})[key] = pixmap
+
+    def invalidate(self, layer_id):
+        self.layers.pop(layer_id, None)
+        self.minimum_widths.pop(layer_id, None)
+
+    def invalidate_legend(self, layer_id):
+        self.minimum_widths.pop(layer_id, None)
+
+    def minimum_width(self, model, layer_node):
+        """ Largest minimum icon width of the layer symbol legend nodes """
+        layer_id = layer_node.layerId()
+        width = self.minimum_widths.get(layer_id)
+        if width is None:
+            width = max(
+                (
+                    l_node.minimumIconSize().width()
+                    for l_node in model.layerLegendNodes(layer_node)
+                    if isinstance(l_node, QgsSymbolLegendNode)
+                ),
+                default=0,
+            )
+            self.minimum_widths[layer_id] = width
+        return width
+
+    def clear(self):
+        self.layers.clear()
+        self.minimum_widths.clear()
+
+
+legend_pixmap_cache = LegendPixmapCache()
+
+
+class RenderContextCache:
+    """ Render contexts used to draw the legend symbols.
+
+    Building a QgsRenderContext copies the map canvas settings: the contexts are
+    kept until the canvas extent, scale, magnification or CRS change (map
+    context) or until the legend map view data change (text context) """
+
+    def __init__(self):
+        self.canvas = None
+        self.context = None
+        self.text_context = None
+        self.text_context_key = None
+        self.font_metrics = {}
+
+    def attach(self, canvas):
+        self.detach()
+        self.canvas = canvas
+        canvas.extentsChanged.connect(self.invalidate)
+        canvas.scaleChanged.connect(self.invalidate)
+        canvas.destinationCrsChanged.connect(self.invalidate)
+        canvas.magnificationChanged.connect(self.invalidate)
+
+    def detach(self):
+        if self.canvas is None:
+            return
+        self.canvas.extentsChanged.disconnect(self.invalidate)
+        self.canvas.scaleChanged.disconnect(self.invalidate)
+        self.canvas.destinationCrsChanged.disconnect(self.invalidate)
+        self.canvas.magnificationChanged.disconnect(self.invalidate)
+        self.canvas = None
+        self.invalidate()
+
+    def invalidate(self, *args):
+        self.context = None
+        self.font_metrics.clear()
+
+    def map_context(self):
+        """ Render context built from the map canvas settings """
+        if self.canvas is None:
+            self.attach(iface.mapCanvas())
+        if self.context is None:
+            self.context = QgsRenderContext.fromMapSettings(self.canvas.mapSettings())
+        return self.context
+
+    def legend_context(self):
+        """ Render context built from the layer tree model legend map view data,
+        or None if the map view data are not set """
+        key = iface.layerTreeView().model().legendMapViewData()
+        if key != self.text_context_key:
+            self.text_context_key = key
+            self.text_context = createTemporaryRenderContext(*key)
+        return self.text_context
+
+    def scaled_font_metrics(self, text_format):
+        """ Return the metrics of the text format font, scaled for the map
+        context """
+        key = (
+            text_format.font().toString(),
+            text_format.size(),
+            int(text_format.sizeUnit()),
+        )
+        metrics = self.font_metrics.get(key)
+        if metrics is None:
+            metrics = QFontMetricsF(text_format.scaledFont(self.map_context()))
+            self.font_metrics[key] = metrics
+        return metrics
+
+
+render_context_cache = RenderContextCache()
+
+
+def createTemporaryRenderContext(mupp, dpi, scale):
+
+    if qgsDoubleNear(mupp, 0.0) or dpi == 0 or qgsDoubleNear(scale, 0.0):
+        return None
+
+    render_context = QgsRenderContext()
+    render_context.setScaleFactor(dpi / 25.4)
+    render_context.setRendererScale(scale)
+    render_context.setMapToPixel(QgsMapToPixel(mupp))
+    return render_context
+
+
+class LegendRenderSignals(QObject):
+    finished = pyqtSignal(str, object, QImage)
+
+
+class LegendRenderTask(QRunnable):
+    """ Render a legend symbol in a QImage, outside of the GUI thread. The task
+    works on copies of the symbol, text format and render contexts """
+
+    def __init__(self, layer_id, key, legend_node, symbol, symbol_size, text):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = LegendRenderSignals()
+        self.layer_id = layer_id
+        self.key = key
+        self.symbol = symbol.clone()
+        self.symbol_size = QSize(symbol_size)
+        self.text = text
+        self.context = QgsRenderContext(render_context_cache.map_context())
+        self.text_context = None
+        self.text_format = None
+        if text:
+            text_context = render_context_cache.legend_context()
+            if text_context:
+                self.text_context = QgsRenderContext(text_context)
+                self.text_format = QgsTextFormat(legend_node.textOnSymbolTextFormat())
+
+    def run(self):
+        image = QImage(self.symbol_size, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        self.context.setPainter(painter)
+        self.symbol.drawPreviewIcon(painter, self.symbol_size, self.context)
+        self.context.setPainter(None)
+
+        if self.text_context:
+            font_metrics = QFontMetricsF(self.text_format.scaledFont(self.context))
+            try:
+                drawTextOnSymbol(
+                    painter,
+                    self.symbol_size,
+                    self.text,
+                    self.text_format,
+                    self.text_context,
+                    font_metrics,
+                )
+            except Exception as e:
+                QgsMessageLog.logMessage(str(e))
+
+        painter.end()
+        self.signals.finished.emit(self.layer_id, self.key, image)
+
+
+class AsyncLegendRenderer(QObject):
+    """ Render the legend symbols in a thread pool.
+
+    Until a symbol is rendered, a transparent placeholder is displayed. When the
+    rendering is done, only the indexes which requested the symbol are
+    refreshed. Jobs which did not start yet are cancelled when all their indexes
+    are scrolled out of view """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.view = None
+        # {(layer_id, key): (task, [QPersistentModelIndex])}
+        self.pending = {}
+        self.placeholders = {}
+
+    def placeholder(self, size):
+        key = (size.width(), size.height())
+        pixmap = self.placeholders.get(key)
+        if pixmap is None:
+            pixmap = QPixmap(size)
+            pixmap.fill(Qt.transparent)
+            self.placeholders[key] = pixmap
+        return pixmap
+
+    def request(self, index, legend_node, layer_id, key, symbol, symbol_size, text):
+        """ Schedule the rendering of a symbol and return a placeholder """
+        if self.view is None:
+            self.view = iface.layerTreeView()
+            self.view.model().viewport_tracker.changed.connect(self.cancel_hidden)
+
+        self.pool.setMaxThreadCount(self.view.model().style.legend_render_jobs)
+
+        job = self.pending.get((layer_id, key))
+        if job:
+            job[1].append(QPersistentModelIndex(index))
+        else:
+            task = LegendRenderTask(
+                layer_id, key, legend_node, symbol, symbol_size, text
+            )
+            task.signals.finished.connect(self.on_finished)
+            self.pending[(layer_id, key)] = (task, [QPersistentModelIndex(index)])
+            self.pool.start(task)
+        return self.placeholder(symbol_size)
+
+    def on_finished(self, layer_id, key, image):
+        legend_pixmap_cache.insert(layer_id, key, QPixmap.fromImage(image))
+        _, indexes = self.pending.pop((layer_id, key), (None, []))
+        model = self.view.model()
+        for index in indexes:
+            if index.isValid():
+                model.refresh_decoration(QModelIndex(index))
+
+    def cancel_hidden(self):
+        """ Cancel the jobs whose indexes are all out of view """
+        tracker = self.view.model().viewport_tracker
+        for job_key, (task, indexes) in list(self.pending.items()):
+            if any(tracker.is_hot(index) for index in indexes):
+                continue
+            if self.pool.tryTake(task):
+                del self.pending[job_key]
+                model = self.view.model()
+                # Placeholders must not stay in the decoration cache
+                for index in indexes:
+                    if index.isValid():
+                        model.drop_decoration(QModelIndex(index))
+
+    def cancel_all(self):
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.pending.clear()
+
+
+async_legend_renderer = AsyncLegendRenderer()
+
+
+def pixmapForLegendNode(legend_node, index=None):
+    """ Render the symbol of a legend node. If index is given and the
+    asynchronous rendering is enabled, a placeholder is returned until the
+    symbol is rendered, then the index is refreshed """
+
+    # handles only symbol nodes
+    if not isinstance(legend_node, QgsSymbolLegendNode):
+        return
+
+    # If size is default, use default implementation
+    size = iface.layerTreeView().iconSize()
+    if size.width() in (-1, 16):
+        size = QSize(18, 18)
+
+    symbol = legend_node.symbol()
+    if not symbol:
+        return
+
+    # Compute minimum width
+    model = iface.layerTreeView().model()
+    if not legend_node.layerNode():
+        return
+
+    text = legend_node.textOnSymbolLabel()
+
+    minimum_width = max(
+        legend_pixmap_cache.minimum_width(model, legend_node.layerNode())
+        + (8 if text else 0),
+        size.width(),
+    )
+
+    symbol_size = QSize(minimum_width, size.height())
+
+    # Only render symbols which were not rendered yet
+    layer_id = legend_node.layerNode().layerId()
+    _, dpi, _ = model.legendMapViewData()
+    key = (
+        hash(QgsSymbolLayerUtils.symbolProperties(symbol)),
+        symbol_size.width(),
+        symbol_size.height(),
+        text,
+        dpi,
+    )
+    pixmap = legend_pixmap_cache.get(layer_id, key)
+    if pixmap is None:
+        if index is not None and model.style.async_legend_rendering:
+            return async_legend_renderer.request(
+                index, legend_node, layer_id, key, symbol, symbol_size, text
+            )
+        pixmap = renderLegendPixmap(legend_node, symbol, symbol_size, text)
+        legend_pixmap_cache.insert(layer_id, key, pixmap)
+    return pixmap
+
+
+def renderLegendPixmap(legend_node, symbol, symbol_size, text):
+
+    context = render_context_cache.map_context()
+    pixmap = QgsSymbolLayerUtils.symbolPreviewPixmap(symbol, symbol_size, 0, context)
+    context.setPainter(None)
+
+    if text:
+        painter = QPainter(pixmap)
+        text_format = legend_node.textOnSymbolTextFormat()
+
+        try:
+            text_context = render_context_cache.legend_context()
+            if text_context:
+                font_metrics = render_context_cache.scaled_font_metrics(text_format)
+                drawTextOnSymbol(
+                    painter,
+                    symbol_size,
+                    text,
+                    text_format,
+                    text_context,
+                    font_metrics,
+                )
+
+        except Exception as e:
+            QgsMessageLog.logMessage(str(e))
+
+        painter.end()
+
+    return pixmap
+
+
+def drawTextOnSymbol(painter, symbol_size, text, text_format, text_context, metrics):
+    """ Draw the text on symbol label, centered on the symbol """
+    painter.setRenderHint(QPainter.Antialiasing)
+    text_context.setPainter(painter)
+
+    y_baseline_v_center = (
+        symbol_size.height() + metrics.ascent() - metrics.descent()
+    ) / 2
+
+    QgsTextRenderer.drawText(
+        QPointF(symbol_size.width() / 2, y_baseline_v_center),
+        0,
+        QgsTextRenderer.AlignCenter,
+        [text],
+        text_context,
+        text_format,
+    )
+    text_context.setPainter(None)
@@ -9,6 +9,7 @@ from qgis.core import QgsLayerTree
 
 from .resourcebrowserimpl import ResourceBrowser
 from .colorfontdialog import ColorFontDialog
+from .iconcache import icon_cache
 
 
 class LayerTreeMenuProvider(QObject):
@@ -54,22 +55,12 @@ class LayerTreeMenuProvider(QObject):
         action_set_custom_font.triggered.connect(self.set_custom_font)
         menu.addAction(action_set_custom_font)
 
-        custom_icon = any(
-            node.customProperty("plugins/customTreeIcon/icon") for node in self.nodes
-        )
-        custom_font = (
-            any(
-                node.customProperty("plugins/customTreeIcon/font")
-                for node in self.nodes
-            )
-            or any(
-                node.customProperty("plugins/customTreeIcon/textColor")
-                for node in self.nodes
-            )
-            or any(
-                node.customProperty("plugins/customTreeIcon/backgroundColor")
-                for node in self.nodes
-            )
+        palette = view.model().palette
+        styles = [palette.node_style(node) for node in self.nodes]
+        custom_icon = any(style.icon for style in styles)
+        custom_font = any(
+            style.font or style.text_color or style.background_color
+            for style in styles
         )
         if custom_icon or custom_font:
             if custom_icon and custom_font:
@@ -86,16 +77,15 @@ class LayerTreeMenuProvider(QObject):
 
     def set_custom_icon_from_qgis(self):
         """ Set a custom icon as a custom property on the selected nodes """
-        dialog = ResourceBrowser(iface.mainWindow())
+        dialog = ResourceBrowser.shared()
         if len(self.nodes) == 1:
-            dialog.set_icon(
-                self.nodes[0].customProperty("plugins/customTreeIcon/icon", "")
-            )
+            palette = iface.layerTreeView().model().palette
+            dialog.set_icon(palette.node_style(self.nodes[0]).icon or "")
         res = dialog.exec()
         if res == QDialog.Accepted:
-            for node in self.nodes:
-                node.setCustomProperty("plugins/customTreeIcon/icon", dialog.icon)
-        dialog.deleteLater()
+            with iface.layerTreeView().model().batch_update() as batch:
+                for node in self.nodes:
+                    batch.set_icon(node, dialog.icon)
 
     def set_custom_font(self):
         """ Set a custom icon as a custom property on the selected nodes """
@@ -103,33 +93,23 @@ class LayerTreeMenuProvider(QObject):
 
         f = iface.layerTreeView().model().layerTreeNodeFont(QgsLayerTree.NodeLayer)
 
+        palette = iface.layerTreeView().model().palette
         for node in self.nodes:
-            if node.customProperty("plugins/customTreeIcon/font"):
-                f.fromString(node.customProperty("plugins/customTreeIcon/font"))
-                text_color = node.customProperty(
-                    "plugins/customTreeIcon/textColor", "black"
-                )
-                background_color = node.customProperty(
-                    "plugins/customTreeIcon/backgroundColor", "white"
-                )
-                dialog.setTextColor(QColor(text_color))
-                dialog.setBackgroundColor(QColor(background_color))
+            style = palette.node_style(node)
+            if style.font:
+                f.fromString(style.font)
+                dialog.setTextColor(QColor(style.text_color or "black"))
+                dialog.setBackgroundColor(QColor(style.background_color or "white"))
 
                 break
         dialog.setCurrentFont(f)
         res = dialog.exec()
         if res == QDialog.Accepted:
-            for node in self.nodes:
-                node.setCustomProperty(
-                    "plugins/customTreeIcon/font", dialog.currentFont().toString()
-                )
-                node.setCustomProperty(
-                    "plugins/customTreeIcon/textColor", dialog.textColor().name()
-                )
-                node.setCustomProperty(
-                    "plugins/customTreeIcon/backgroundColor",
-                    dialog.backgroundColor().name(),
-                )
+            with iface.layerTreeView().model().batch_update() as batch:
+                for node in self.nodes:
+                    batch.set_font(node, dialog.currentFont())
+                    batch.set_text_color(node, dialog.textColor())
+                    batch.set_background_color(node, dialog.backgroundColor())
 
         dialog.deleteLater()
 
@@ -150,14 +130,15 @@ class LayerTreeMenuProvider(QObject):
             return
 
         settings.setValue("iconpath", os.path.dirname(filename))
+        # The file may have been edited since it was last displayed
+        icon_cache.invalidate(filename)
 
-        for node in self.nodes:
-            node.setCustomProperty("plugins/customTreeIcon/icon", filename)
+        with iface.layerTreeView().model().batch_update() as batch:
+            for node in self.nodes:
+                batch.set_icon(node, filename)
 
     def reset_custom_icon(self):
         """ Delete the custom property, which will restore the default icon """
-        for node in self.nodes:
-            node.removeCustomProperty("plugins/customTreeIcon/icon")
-            node.removeCustomProperty("plugins/customTreeIcon/font")
-            node.removeCustomProperty("plugins/customTreeIcon/textColor")
-            node.removeCustomProperty("plugins/customTreeIcon/backgroundColor")
+        with iface.layerTreeView().model().batch_update() as batch:
+            for node in self.nodes:
+                batch.reset(node)
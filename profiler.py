@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+""" Find the layer tree nodes which are the slowest to display """
+
+from time import perf_counter
+
+from PyQt5.QtCore import QModelIndex, QPersistentModelIndex, Qt
+
+from .iconcache import icon_cache
+from .instrumentation import ROLE_NAMES, instrumentation
+from .legendpixmap import legend_pixmap_cache
+
+# Roles requested by the view to paint a row
+PROFILED_ROLES = (
+    Qt.DisplayRole,
+    Qt.DecorationRole,
+    Qt.FontRole,
+    Qt.ForegroundRole,
+    Qt.BackgroundRole,
+    Qt.CheckStateRole,
+    Qt.SizeHintRole,
+)
+
+# Instrumentation labels which explain the duration of a call
+CAUSES = {
+    "legend/render": "symbol render",
+    "legend/text": "text render",
+    "decoration/icon": "icon load",
+    "font/build": "font parsing",
+    "decoration/edit_state": "edit overlay",
+}
+
+
+class NodeProfile:
+    """ Time spent in CustomTreeModel.data for a node, per role and per cause """
+
+    def __init__(self, index, name, path):
+        self.index = QPersistentModelIndex(index)
+        self.name = name
+        self.path = path
+        self.total = 0.0
+        self.roles = {}
+        self.causes = {}
+
+    def add(self, role, duration, capture):
+        self.total += duration
+        self.roles[role] = self.roles.get(role, 0) + duration
+
+        # Text rendering is part of the symbol rendering
+        if "legend/render" in capture and "legend/text" in capture:
+            capture["legend/render"] -= capture["legend/text"]
+        explained = 0
+        for label, cause in CAUSES.items():
+            if label in capture:
+                self.causes[cause] = self.causes.get(cause, 0) + capture[label]
+                explained += capture[label]
+        self.causes["other"] = self.causes.get("other", 0) + duration - explained
+
+    def cause(self):
+        """ Main reason of the time spent on this node """
+        return max(self.causes, key=self.causes.get) if self.causes else "other"
+
+    def slowest_role(self):
+        role = max(self.roles, key=self.roles.get)
+        return ROLE_NAMES.get(role) or f"role {int(role)}"
+
+
+def index_name(model, index):
+    return model.data(index, Qt.DisplayRole) or ""
+
+
+def profile(model):
+    """ Call every profiled role of CustomTreeModel.data for every index, with
+    cold caches, and return the NodeProfiles sorted from the slowest """
+    profiles = []
+
+    # Measure the actual cost of each node, not of a cache lookup
+    model.clear_decoration_cache()
+    model.font_cache.clear()
+    legend_pixmap_cache.clear()
+    icon_cache.clear()
+
+    # Every row is profiled synchronously, in view or not
+    style = model.style
+    model.style = style._replace(lazy_decorations=False, async_legend_rendering=False)
+
+    was_enabled = instrumentation.enabled
+    instrumentation.set_enabled(True)
+    try:
+        stack = [(QModelIndex(), "")]
+        while stack:
+            parent, parent_path = stack.pop()
+            for row in range(model.rowCount(parent)):
+                index = model.index(row, 0, parent)
+                instrumentation.capture = {}
+                name = index_name(model, index)
+                path = f"{parent_path} / {name}" if parent_path else name
+                node_profile = NodeProfile(index, name, path)
+
+                for role in PROFILED_ROLES:
+                    instrumentation.capture = {}
+                    start = perf_counter()
+                    model.data(index, role)
+                    duration = perf_counter() - start
+                    node_profile.add(role, duration, instrumentation.capture)
+
+                profiles.append(node_profile)
+                stack.append((index, path))
+    finally:
+        instrumentation.capture = None
+        instrumentation.set_enabled(was_enabled)
+        model.style = style
+
+    profiles.sort(key=lambda node_profile: node_profile.total, reverse=True)
+    return profiles
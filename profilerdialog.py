@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QModelIndex, QSize, Qt
+from PyQt5.QtGui import QGuiApplication
+from PyQt5.QtWidgets import (
+    QDialog,
+    QLabel,
+    QVBoxLayout,
+    QHBoxLayout,
+    QPushButton,
+    QTreeWidget,
+    QTreeWidgetItem,
+    QHeaderView,
+)
+
+from qgis.utils import iface
+
+from .profiler import profile
+
+
+class ProfilerDialog(QDialog):
+    """ Profile the layer tree and list its slowest nodes. Clicking a node
+    selects it in the layer tree """
+
+    # Number of nodes listed
+    LIMIT = 200
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.profiles = []
+
+        self.setWindowTitle(self.tr("Layer tree profile"))
+        self.setMinimumSize(QSize(600, 400))
+        layout = QVBoxLayout(self)
+
+        self.summary_label = QLabel(self)
+        layout.addWidget(self.summary_label)
+
+        self.tree = QTreeWidget(self)
+        self.tree.setRootIsDecorated(False)
+        self.tree.setHeaderLabels(
+            [
+                self.tr("Node"),
+                self.tr("Time (ms)"),
+                self.tr("Cause"),
+                self.tr("Slowest role"),
+            ]
+        )
+        self.tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.tree.itemClicked.connect(self.on_item_clicked)
+        layout.addWidget(self.tree)
+
+        hlayout = QHBoxLayout()
+        profile_button = QPushButton(self.tr("Profile again"), self)
+        profile_button.clicked.connect(self.run)
+        hlayout.addWidget(profile_button)
+        hlayout.addStretch()
+        close_button = QPushButton(self.tr("Close"), self)
+        close_button.clicked.connect(self.close)
+        hlayout.addWidget(close_button)
+        layout.addLayout(hlayout)
+
+    def run(self):
+        """ Profile the layer tree and display the slowest nodes """
+        QGuiApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            self.profiles = profile(iface.layerTreeView().model())
+        finally:
+            QGuiApplication.restoreOverrideCursor()
+
+        total = sum(node_profile.total for node_profile in self.profiles)
+        self.summary_label.setText(
+            self.tr("{0} nodes profiled in {1:.1f} ms").format(
+                len(self.profiles), total * 1000
+            )
+        )
+
+        self.tree.clear()
+        for row, node_profile in enumerate(self.profiles[: self.LIMIT]):
+            item = QTreeWidgetItem(
+                [
+                    node_profile.name,
+                    f"{node_profile.total * 1000:.2f}",
+                    node_profile.cause(),
+                    node_profile.slowest_role(),
+                ]
+            )
+            item.setToolTip(0, node_profile.path)
+            item.setData(0, Qt.UserRole, row)
+            item.setTextAlignment(1, Qt.AlignRight | Qt.AlignVCenter)
+            self.tree.addTopLevelItem(item)
+
+    def on_item_clicked(self, item, column):
+        node_profile = self.profiles[item.data(0, Qt.UserRole)]
+        if not node_profile.index.isValid():
+            return
+        index = QModelIndex(node_profile.index)
+        view = iface.layerTreeView()
+        view.setCurrentIndex(index)
+        view.scrollTo(index)
@@ -4,16 +4,22 @@ import os
 
 from PyQt5.QtCore import (
     QAbstractListModel,
-    QResource,
     Qt,
     QModelIndex,
     QSortFilterProxyModel,
     QSize,
+    QTimer,
 )
-from PyQt5.QtGui import QIcon, QGuiApplication
+from PyQt5.QtGui import QIcon, QGuiApplication, QPixmap
 from PyQt5.QtWidgets import QDialog, QTreeWidgetItem, QMenu
 
+from qgis.utils import iface
+
 from .resourcebrowser import Ui_ResourceBrowser
+from .iconcache import icon_cache
+from .resourceindex import resource_index
+from .resourcesearch import ResourceSearchIndex
+from .thumbnails import ThumbnailLoader
 
 
 class RessourceModel(QAbstractListModel):
@@ -23,44 +29,192 @@ class RessourceModel(QAbstractListModel):
         self.ressource_root = ""
         self.icons = []
         self.extensions = extensions
+        self.icon_size = 32
+        self.device_pixel_ratio = 1.0
+        # Thumbnails of the current folder: {name: QPixmap}
+        self.thumbnails = {}
+        # Icons of the current folder missing from its thumbnail atlas
+        self.missing = set()
+        # Global search results, displayed instead of the folder icons:
+        # [(folder, name)]
+        self.matches = None
+        # Row of each displayed icon: {path: row}
+        self.rows = {}
+
+        self.loader = ThumbnailLoader(self)
+        self.loader.finished.connect(self.on_thumbnail_ready)
+        self.placeholder = None
+
+    def set_matches(self, matches):
+        self.beginResetModel()
+        self.loader.cancel_all()
+        self.matches = matches
+        self.update_rows()
+        self.endResetModel()
 
     def set_source(self, path):
         self.beginResetModel()
+        self.loader.cancel_all()
+        self.matches = None
         self.ressource_root = path
         self.icons = sorted(
             [
                 name
-                for name in QResource(self.ressource_root).children()
+                for name in resource_index.files(path)
                 if (
-                    QResource(self.ressource_root + "/" + name).isFile()
-                    and (
-                        self.extensions is None
-                        or os.path.splitext(name)[1].lower() in self.extensions
-                    )
+                    self.extensions is None
+                    or os.path.splitext(name)[1].lower() in self.extensions
                 )
             ]
         )
+        self.load_thumbnails()
+        self.update_rows()
         self.endResetModel()
 
+    def entry(self, row):
+        """ Return the (folder, name) of the icon displayed at row """
+        if self.matches is not None:
+            return self.matches[row]
+        return self.ressource_root, self.icons[row]
+
+    def update_rows(self):
+        self.rows = {}
+        for row in range(self.rowCount()):
+            folder, name = self.entry(row)
+            self.rows[f":{folder}/{name}"] = row
+
+    def load_thumbnails(self):
+        """ Load the thumbnails of the current folder from the on-disk cache.
+        The first time a folder is opened, its thumbnails are rendered in the
+        background, and saved when they are all done """
+        self.thumbnails = {}
+        self.missing = set()
+        if not self.icons or not resource_index.is_persistent(self.ressource_root):
+            return
+
+        self.thumbnails = (
+            resource_index.load_thumbnails(
+                self.ressource_root, self.icon_size, self.device_pixel_ratio
+            )
+            or {}
+        )
+        saved = len(self.thumbnails)
+        for name in self.icons:
+            if name in self.thumbnails:
+                continue
+            path = f":{self.ressource_root}/{name}"
+            # Rendered when the folder was previously opened
+            pixmap = icon_cache.get(path, self.icon_size, self.device_pixel_ratio)
+            if pixmap is not None:
+                self.thumbnails[name] = pixmap
+                continue
+            self.missing.add(name)
+            self.loader.request(
+                path, self.icon_size, self.device_pixel_ratio, background=True
+            )
+        # All the thumbnails were rendered, but not saved yet
+        if not self.missing and len(self.thumbnails) > saved:
+            self.save_thumbnails()
+
+    def save_thumbnails(self):
+        resource_index.save_thumbnails(
+            self.ressource_root,
+            self.thumbnails,
+            self.icon_size,
+            self.device_pixel_ratio,
+        )
+
+    def thumbnail(self, folder, name):
+        """ Return the thumbnail of an icon, or a placeholder until it is
+        rendered """
+        if folder == self.ressource_root:
+            thumbnail = self.thumbnails.get(name)
+            if thumbnail is not None:
+                return thumbnail
+
+        path = f":{folder}/{name}"
+        pixmap = icon_cache.get(path, self.icon_size, self.device_pixel_ratio)
+        if pixmap is not None:
+            return pixmap
+
+        self.loader.request(path, self.icon_size, self.device_pixel_ratio)
+        if self.placeholder is None:
+            size = round(self.icon_size * self.device_pixel_ratio)
+            self.placeholder = QPixmap(size, size)
+            self.placeholder.fill(Qt.transparent)
+            self.placeholder.setDevicePixelRatio(self.device_pixel_ratio)
+        return self.placeholder
+
+    def on_thumbnail_ready(self, path, image):
+        pixmap = icon_cache.insert_image(
+            path, self.icon_size, self.device_pixel_ratio, image
+        )
+
+        folder, _, name = path[1:].rpartition("/")
+        if folder == self.ressource_root and name in self.missing:
+            self.thumbnails[name] = pixmap
+            self.missing.discard(name)
+            if not self.missing:
+                self.save_thumbnails()
+
+        row = self.rows.get(path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
             return
 
-        name = self.icons[index.row()]
-        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+        folder, name = self.entry(index.row())
+
+        if role == Qt.DisplayRole:
+            if self.matches is not None:
+                return f"{name}\n{folder}"
+            return name
+        if role == Qt.ToolTipRole:
             return name
         if role == Qt.EditRole:
-            return f":{self.ressource_root}/{name}"
+            return f":{folder}/{name}"
         if role == Qt.DecorationRole:
-            return QIcon(f":{self.ressource_root}/{name}")
+            return self.thumbnail(folder, name)
 
         return
 
     def rowCount(self, index=QModelIndex()):
+        if self.matches is not None:
+            return len(self.matches)
         return len(self.icons)
 
 
 class ResourceBrowser(QDialog, Ui_ResourceBrowser):
+    """ Browse the icons compiled in the Qt resources.
+
+    The folders are listed when they are expanded, so that opening the browser
+    does not walk the whole resource tree. Use ResourceBrowser.shared() to keep
+    the listed folders for the whole session """
+
+    # Folder selected when the browser opens
+    DEFAULT_FOLDER = "/images/themes/default"
+
+    instance = None
+
+    @classmethod
+    def shared(cls):
+        """ Return the browser shared by the whole plugin, created on first use,
+        without the selection and filter of its previous use """
+        if cls.instance is None:
+            cls.instance = cls(iface.mainWindow())
+        else:
+            cls.instance.reset()
+        return cls.instance
+
+    @classmethod
+    def release(cls):
+        if cls.instance is not None:
+            cls.instance.deleteLater()
+            cls.instance = None
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setupUi(self)
@@ -69,42 +223,124 @@ class ResourceBrowser(QDialog, Ui_ResourceBrowser):
         self.extensions = (".svg", ".png", ".jpg", ".gif", ".jpeg", ".bmp", ".ico")
 
         self.resource_model = RessourceModel(self.extensions, self)
+        self.view.setIconSize(QSize(32, 32))
+        self.resource_model.icon_size = self.view.iconSize().width()
+        self.resource_model.device_pixel_ratio = self.devicePixelRatioF()
         self.proxy_model = QSortFilterProxyModel()
         self.proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
         self.proxy_model.setSourceModel(self.resource_model)
         self.view.setModel(self.proxy_model)
         self.view.setContextMenuPolicy(Qt.CustomContextMenu)
         self.view.customContextMenuRequested.connect(self.on_context_menu)
-        self.filterLineEdit.textChanged.connect(self.proxy_model.setFilterRegExp)
+        # The search index is built from the event loop, in slices, while the
+        # browser is open
+        self.search_index = ResourceSearchIndex(self.extensions)
+        self.search_timer = QTimer(self)
+        self.search_timer.setInterval(0)
+        self.search_timer.timeout.connect(self.build_search_index)
+        self.filterLineEdit.textChanged.connect(self.update_filter)
+        self.allFoldersCheckBox.toggled.connect(self.update_filter)
         self.view.clicked.connect(self.on_click)
         self.view.doubleClicked.connect(self.on_double_click)
 
         self.splitter.setStretchFactor(0, 0)
         self.splitter.setStretchFactor(1, 1)
-        self.default_item = None
         self.ressourceTree.setColumnCount(2)
-        self.build_resource_tree(self.ressourceTree.invisibleRootItem(), "")
         self.ressourceTree.setColumnHidden(1, True)
+        self.ressourceTree.itemExpanded.connect(self.populate)
         self.ressourceTree.currentItemChanged.connect(self.on_ressource_changed)
-        self.ressourceTree.expandItem(self.default_item)
-        self.ressourceTree.setCurrentItem(self.default_item)
+        self.populated = set()
+        self.populate(self.ressourceTree.invisibleRootItem())
+
+        default_item = self.find_item(self.DEFAULT_FOLDER)
+        if default_item:
+            self.ressourceTree.expandItem(default_item)
+            self.ressourceTree.setCurrentItem(default_item)
+
+    def item_key(self, item):
+        if item is self.ressourceTree.invisibleRootItem():
+            return ""
+        return item.data(1, Qt.DisplayRole)
 
-    def build_resource_tree(self, parent_item, parent_key):
-        for key in QResource(parent_key).children():
-            full_key = f"{parent_key}/{key}"
-            if QResource(full_key).isDir():
+    def populate(self, parent_item):
+        """ Add the subfolders of a folder item, the first time it is expanded """
+        parent_key = self.item_key(parent_item)
+        if parent_key in self.populated:
+            return
+        self.populated.add(parent_key)
+
+        for key in resource_index.subfolders(parent_key):
+            item = QTreeWidgetItem([key, f"{parent_key}/{key}"])
+            # Subfolders are unknown until the item is expanded
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+            parent_item.addChild(item)
 
-                item = QTreeWidgetItem([key, full_key])
-                self.build_resource_tree(item, full_key)
-                parent_item.addChild(item)
-                if full_key == "/images/themes/default":
-                    self.default_item = item
+        parent_item.setChildIndicatorPolicy(
+            QTreeWidgetItem.DontShowIndicatorWhenChildless
+        )
+
+    def find_item(self, key):
+        """ Return the item of a folder, populating its parent folders """
+        item = self.ressourceTree.invisibleRootItem()
+        for part in key.strip("/").split("/"):
+            self.populate(item)
+            for row in range(item.childCount()):
+                if item.child(row).text(0) == part:
+                    item = item.child(row)
+                    break
+            else:
+                return None
+        return item
+
+    def showEvent(self, event):
+        if not self.search_index.built:
+            self.search_timer.start()
+        super().showEvent(event)
+
+    def done(self, result):
+        super().done(result)
+        self.search_timer.stop()
+        resource_index.save()
+
+    def build_search_index(self):
+        # Index folders for at most 5 ms per event loop iteration
+        if not self.search_index.build_step(0.005):
+            return
+        self.search_timer.stop()
+        if self.allFoldersCheckBox.isChecked() and self.filterLineEdit.text():
+            self.update_filter()
 
     def on_ressource_changed(self, current_item, previous_item):
         self.resource_model.set_source(current_item.data(1, Qt.DisplayRole))
+        self.update_filter()
+
+    def update_filter(self):
+        """ Filter the icons of the current folder, or search all the folders """
+        text = self.filterLineEdit.text()
+        # Until the search index is built, only the current folder is filtered
+        if self.allFoldersCheckBox.isChecked() and text and self.search_index.built:
+            self.proxy_model.setFilterRegExp("")
+            self.resource_model.set_matches(self.search_index.search(text))
+            return
+
+        if self.resource_model.matches is not None:
+            self.resource_model.set_matches(None)
+        self.proxy_model.setFilterRegExp(text)
+
+    def reset(self):
+        """ Clear the selected icon and the filter. The listed folders and the
+        current folder are kept """
+        self.icon = None
+        self.previewLabel.clear()
+        self.previewName.clear()
+        self.okButton.setEnabled(False)
+        self.filterLineEdit.clear()
+        self.view.clearSelection()
 
     def set_icon(self, url):
-        self.previewLabel.setPixmap(QIcon(url).pixmap(QSize(64, 64)))
+        self.previewLabel.setPixmap(
+            icon_cache.pixmap(url, 64, self.devicePixelRatioF())
+        )
         self.previewName.setText(url)
         self.icon = url
         self.okButton.setEnabled(True)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+""" Persistent index of the Qt resources, with thumbnail atlases
+
+The resources compiled in QGIS are the same for every session of a given QGIS
+version. The folders listed by the resource browser and the thumbnails of their
+icons are saved in the profile directory, under
+cache/layertreeicons/<QGIS_VERSION_INT>, and loaded in bulk in later sessions.
+
+The thumbnails of a folder are saved as a single PNG atlas per thumbnail size:
+a grid of square cells, with the icon names stored in the PNG metadata.
+
+Resources registered by plugins (under /plugins) may change between sessions:
+they are never persisted.
+"""
+
+import json
+import math
+import os
+from hashlib import sha1
+
+from PyQt5.QtCore import QPoint, QRect, QResource, Qt
+from PyQt5.QtGui import QImage, QPainter, QPixmap
+
+from qgis.core import Qgis, QgsApplication
+from qgis.utils import QgsMessageLog
+
+
+class ResourceIndex:
+    """ Subfolders and files of each resource folder, loaded from and saved to
+    the profile directory """
+
+    VERSION = 1
+
+    def __init__(self):
+        # {folder path: (subfolder names, file names)}
+        self.folders = {}
+        self.loaded = False
+        self.dirty = False
+
+    @staticmethod
+    def cache_dir():
+        return os.path.join(
+            QgsApplication.qgisSettingsDirPath(),
+            "cache",
+            "layertreeicons",
+            str(Qgis.QGIS_VERSION_INT),
+        )
+
+    @staticmethod
+    def is_persistent(path):
+        """ Whether a folder is the same between sessions """
+        return bool(path) and path != "/plugins" and not path.startswith("/plugins/")
+
+    def index_path(self):
+        return os.path.join(self.cache_dir(), "index.json")
+
+    def load(self):
+        """ Read the saved index, if any """
+        self.loaded = True
+        try:
+            with open(self.index_path(), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION:
+            return
+        for path, (subfolders, files) in data["folders"].items():
+            self.folders.setdefault(path, (subfolders, files))
+
+    def save(self):
+        """ Write the index, if folders were listed since it was loaded """
+        if not self.dirty:
+            return
+        folders = {
+            path: entry
+            for path, entry in self.folders.items()
+            if self.is_persistent(path)
+        }
+        try:
+            os.makedirs(self.cache_dir(), exist_ok=True)
+            with open(self.index_path(), "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "folders": folders}, f)
+        except OSError as e:
+            QgsMessageLog.logMessage(f"Could not save the resource index: {e}")
+            return
+        self.dirty = False
+
+    def entry(self, path):
+        if not self.loaded:
+            self.load()
+
+        entry = self.folders.get(path)
+        if entry is None:
+            subfolders = []
+            files = []
+            for name in QResource(path).children():
+                if QResource(f"{path}/{name}").isDir():
+                    subfolders.append(name)
+                else:
+                    files.append(name)
+            entry = (subfolders, files)
+            self.folders[path] = entry
+            if self.is_persistent(path):
+                self.dirty = True
+        return entry
+
+    def subfolders(self, path):
+        """ Names of the subfolders of a resource folder ("" is the root) """
+        return self.entry(path)[0]
+
+    def files(self, path):
+        """ Names of the files of a resource folder """
+        return self.entry(path)[1]
+
+    def atlas_path(self, path, pixel_size):
+        digest = sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir(), "atlas", f"{digest}_{pixel_size}.png")
+
+    def load_thumbnails(self, path, size, device_pixel_ratio):
+        """ Return the saved thumbnails of a folder: {name: QPixmap}, or None """
+        if not self.is_persistent(path):
+            return None
+
+        pixel_size = round(size * device_pixel_ratio)
+        atlas = QImage(self.atlas_path(path, pixel_size))
+        if atlas.isNull():
+            return None
+        try:
+            names = json.loads(atlas.text("names"))
+        except ValueError:
+            return None
+
+        columns = max(1, atlas.width() // pixel_size)
+        thumbnails = {}
+        for i, name in enumerate(names):
+            row, column = divmod(i, columns)
+            pixmap = QPixmap.fromImage(
+                atlas.copy(
+                    QRect(
+                        column * pixel_size, row * pixel_size, pixel_size, pixel_size
+                    )
+                )
+            )
+            pixmap.setDevicePixelRatio(device_pixel_ratio)
+            thumbnails[name] = pixmap
+        return thumbnails
+
+    def save_thumbnails(self, path, thumbnails, size, device_pixel_ratio):
+        """ Save the thumbnails of a folder ({name: QPixmap or QImage}) in an
+        atlas """
+        if not self.is_persistent(path) or not thumbnails:
+            return
+
+        pixel_size = round(size * device_pixel_ratio)
+        names = sorted(thumbnails)
+        columns = math.ceil(math.sqrt(len(names)))
+        rows = math.ceil(len(names) / columns)
+
+        atlas = QImage(
+            columns * pixel_size, rows * pixel_size, QImage.Format_ARGB32_Premultiplied
+        )
+        atlas.fill(Qt.transparent)
+        painter = QPainter(atlas)
+        for i, name in enumerate(names):
+            image = thumbnails[name]
+            if isinstance(image, QPixmap):
+                image = image.toImage()
+            image = QImage(image)
+            image.setDevicePixelRatio(1)
+            # Center the thumbnail in its cell
+            row, column = divmod(i, columns)
+            x = column * pixel_size + (pixel_size - image.width()) // 2
+            y = row * pixel_size + (pixel_size - image.height()) // 2
+            painter.drawImage(QPoint(x, y), image)
+        painter.end()
+        atlas.setText("names", json.dumps(names))
+
+        atlas_path = self.atlas_path(path, pixel_size)
+        try:
+            os.makedirs(os.path.dirname(atlas_path), exist_ok=True)
+        except OSError:
+            return
+        if not atlas.save(atlas_path, "PNG"):
+            QgsMessageLog.logMessage(f"Could not save the thumbnails of {path}")
+
+
+# Shared instance
+resource_index = ResourceIndex()
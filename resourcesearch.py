@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+""" Token and n-gram index over the icon paths of every resource folder """
+
+import os
+import re
+from bisect import bisect_left, bisect_right
+from heapq import merge, nsmallest
+from time import perf_counter
+
+from .resourceindex import resource_index
+
+
+# Characters splitting the query in words
+SEPARATORS = re.compile(r"[\s/_\-.]+")
+# Words of an icon name: mActionZoomIn -> m, action, zoom, in
+NAME_WORDS = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+
+def ngrams(text, n):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class ResourceSearchIndex:
+    """ Search the icons of all the resource folders as the user types.
+
+    The icons are indexed by the words of their names (exact and prefix
+    lookups) and by the 1, 2 and 3 character n-grams of their lowercase paths
+    (substring lookups).
+    Matches are ranked: whole name, whole word, word prefix, substring of the
+    name, then substring of the folder path only """
+
+    # Maximum number of results
+    LIMIT = 500
+    # Number of icons indexed per build step
+    CHUNK = 25
+
+    def __init__(self, extensions):
+        self.extensions = extensions
+        self.built = False
+        # Generator indexing one folder per step, see build_step
+        self.builder = None
+        # Indexed icons: [(folder, name)]
+        self.icons = []
+        # Lowercase path, name and words of each icon
+        self.paths = []
+        self.names = []
+        self.words = []
+        # {lowercase name without extension: [icon id]}
+        self.stems = {}
+        # Sorted [(word, icon id)], for exact and prefix lookups
+        self.word_index = []
+        # {1, 2 or 3 characters: set of icon ids}
+        self.postings = {}
+        # Rank of each icon by name length then path, to break ties
+        self.order = []
+
+    def build_step(self, budget):
+        """ Walk the resource folders and index their icons for about budget
+        seconds, so that the index can be
+        built from the event loop without freezing the GUI. Returns True once
+        the index is built """
+        if self.built:
+            return True
+        if self.builder is None:
+            self.builder = self.index_folders()
+
+        deadline = perf_counter() + budget
+        for _ in self.builder:
+            if perf_counter() > deadline:
+                return False
+
+        self.builder = None
+        self.built = True
+        return True
+
+    def index_folders(self):
+        """ Index the icons of the resource folders, yielding every CHUNK icons
+        and every few hundred merged entries. Each chunk of icons is sorted on
+        its own, then the chunks are merged, so that no step sorts the whole
+        index """
+        word_runs = []
+        order_runs = []
+
+        def sort_chunk(first):
+            icon_ids = range(first, len(self.icons))
+            word_runs.append(
+                sorted(
+                    (word, icon_id)
+                    for icon_id in icon_ids
+                    for word in self.words[icon_id]
+                )
+            )
+            order_runs.append(
+                sorted(
+                    (len(self.names[icon_id]), self.paths[icon_id], icon_id)
+                    for icon_id in icon_ids
+                )
+            )
+
+        first = 0
+        folders = [""]
+        while folders:
+            folder = folders.pop()
+            folders.extend(
+                f"{folder}/{name}" for name in resource_index.subfolders(folder)
+            )
+            for name in resource_index.files(folder):
+                if os.path.splitext(name)[1].lower() in self.extensions:
+                    self.add(folder, name)
+                    if len(self.icons) - first == self.CHUNK:
+                        sort_chunk(first)
+                        first = len(self.icons)
+                        yield
+            yield
+        sort_chunk(first)
+
+        for count, entry in enumerate(merge(*word_runs), 1):
+            self.word_index.append(entry)
+            if not count % 500:
+                yield
+
+        self.order = [0] * len(self.icons)
+        for rank, (_, _, icon_id) in enumerate(merge(*order_runs)):
+            self.order[icon_id] = rank
+            if not rank % 500:
+                yield
+
+    def add(self, folder, name):
+        icon_id = len(self.icons)
+        stem = os.path.splitext(name)[0]
+        words = {word.lower() for word in NAME_WORDS.findall(stem)}
+        path = f"{folder}/{name}".lower()
+
+        self.icons.append((folder, name))
+        self.paths.append(path)
+        self.names.append(name.lower())
+        self.words.append(words)
+        self.stems.setdefault(stem.lower(), []).append(icon_id)
+        for n in (1, 2, 3):
+            for gram in ngrams(path, n):
+                self.postings.setdefault(gram, set()).add(icon_id)
+
+    def prefixed(self, word):
+        """ Return {icon id: 1 if a word of the name is word, 2 if it starts with
+        word} """
+        first = bisect_left(self.word_index, (word,))
+        last = bisect_right(self.word_index, (word + "\uffff",))
+        scores = {}
+        for name_word, icon_id in self.word_index[first:last]:
+            if name_word == word:
+                scores[icon_id] = 1
+            else:
+                scores.setdefault(icon_id, 2)
+        return scores
+
+    def containing(self, words):
+        """ Ids of the icons whose path contains all the words """
+        grams = set()
+        for word in words:
+            grams |= ngrams(word, min(3, len(word)))
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result &= posting
+
+        # The trigrams of a longer word may match in a different order: check
+        # the substrings
+        checked = [word for word in words if len(word) > 3]
+        if not checked:
+            return result
+        return [
+            icon_id
+            for icon_id in result
+            if all(word in self.paths[icon_id] for word in checked)
+        ]
+
+    def word_score(self, icon_id, word, prefixed):
+        """ Rank of the match of a single word (lower is better) """
+        score = prefixed.get(icon_id)
+        if score is not None:
+            return score
+        if word in self.names[icon_id]:
+            return 3
+        # Only matches the folder
+        return 4
+
+    def search(self, query):
+        """ Return the (folder, name) of the icons matching the query, best
+        matches first. The index must be built """
+        words = [word for word in SEPARATORS.split(query.lower()) if word]
+        if not words:
+            return []
+
+        if len(words) == 1:
+            ranked = self.search_word(words[0])
+        else:
+            ranked = self.search_words(words)
+        return [self.icons[icon_id] for icon_id in ranked]
+
+    def search_words(self, words):
+        prefixed = [(word, self.prefixed(word)) for word in words]
+        count = len(self.icons)
+
+        def key(icon_id):
+            score = 0
+            for word, word_prefixed in prefixed:
+                score += self.word_score(icon_id, word, word_prefixed)
+            return score * count + self.order[icon_id]
+
+        return nsmallest(self.LIMIT, self.containing(words), key=key)
+
+    def search_word(self, word):
+        """ Single word query: gather the matches tier by tier, and stop as
+        soon as there are enough of them """
+        ranked = []
+        seen = set()
+
+        def extend(icon_ids, key):
+            icon_ids = [icon_id for icon_id in icon_ids if icon_id not in seen]
+            icon_ids = nsmallest(self.LIMIT - len(ranked), icon_ids, key=key)
+            seen.update(icon_ids)
+            ranked.extend(icon_ids)
+            return len(ranked) >= self.LIMIT
+
+        count = len(self.icons)
+        prefixed = self.prefixed(word)
+
+        def by_word(icon_id):
+            return prefixed[icon_id] * count + self.order[icon_id]
+
+        def by_name(icon_id):
+            return (word not in self.names[icon_id]) * count + self.order[icon_id]
+
+        if extend(self.stems.get(word, ()), self.order.__getitem__):
+            return ranked
+        if extend(prefixed, by_word):
+            return ranked
+        extend(self.containing([word]), by_name)
+        return ranked
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+""" Rule based styling of the layer tree nodes
+
+The rules are stored as a JSON list in the plugins/layertreeicons/rules setting.
+Each rule has match criteria and style properties, e.g.
+
+```
+{
+    "source": "/mnt/cadastre/*",
+    "provider": "ogr",
+    "icon": "/path/to/cadastre.svg"
+}
+```
+
+Criteria (all optional, a rule without criteria matches every node):
+ - name: regular expression searched in the node name
+ - category: node category (group, raster, point, line, polygon, nogeometry,
+   mesh), or a list of categories
+ - provider: data provider key (ogr, gdal, postgres...), or a list of keys
+ - crs: authority identifier of the layer CRS (EPSG:2154...), or a list of ids
+ - source: glob pattern matched against the layer source path
+ - group: regular expression searched in the names of the parent groups
+
+Style properties: icon, font, text_color and background_color. The rules are
+evaluated in order: for each property, the first matching rule wins. Custom
+properties set on a node take precedence over the rules.
+"""
+
+import json
+import re
+from fnmatch import translate
+from typing import NamedTuple, Optional
+
+from PyQt5.QtGui import QColor
+
+from qgis.core import QgsLayerTree
+from qgis.utils import QgsMessageLog
+
+
+STYLE_PROPERTIES = ("icon", "font", "text_color", "background_color")
+
+
+class RuleStyle(NamedTuple):
+    """ Style resulting from the rules matching a node """
+
+    icon: Optional[str] = None
+    font: Optional[str] = None
+    text_color: Optional[QColor] = None
+    background_color: Optional[QColor] = None
+
+
+class NodeFacts(NamedTuple):
+    """ Attributes of a node the rules can match on """
+
+    name: str
+    category: Optional[str]
+    provider: Optional[str]
+    crs: Optional[str]
+    source: Optional[str]
+    groups: tuple
+
+
+def node_facts(node, category):
+    """ Gather the attributes of a node, once for all the rules """
+    groups = []
+    parent = node.parent()
+    while parent is not None and parent.parent() is not None:
+        groups.append(parent.name())
+        parent = parent.parent()
+
+    provider = crs = source = None
+    layer = node.layer() if QgsLayerTree.isLayer(node) else None
+    if layer:
+        provider = layer.providerType()
+        crs = layer.crs().authid()
+        # Strip the sublayer options of file based sources (path|layername=...)
+        source = layer.source().split("|", 1)[0]
+
+    return NodeFacts(node.name(), category, provider, crs, source, tuple(groups))
+
+
+def one_of(value):
+    """ Criteria values are either a single value or a list of values """
+    if isinstance(value, str):
+        return frozenset((value,))
+    return frozenset(value)
+
+
+class Rule:
+    """ Rule compiled into a list of predicates on NodeFacts """
+
+    def __init__(self, definition):
+        self.predicates = []
+
+        if definition.get("name"):
+            pattern = re.compile(definition["name"])
+            self.predicates.append(lambda facts: pattern.search(facts.name))
+
+        if definition.get("category"):
+            categories = one_of(definition["category"])
+            self.predicates.append(lambda facts: facts.category in categories)
+
+        if definition.get("provider"):
+            providers = one_of(definition["provider"])
+            self.predicates.append(lambda facts: facts.provider in providers)
+
+        if definition.get("crs"):
+            crs = one_of(definition["crs"])
+            self.predicates.append(lambda facts: facts.crs in crs)
+
+        if definition.get("source"):
+            source = re.compile(translate(definition["source"]))
+            self.predicates.append(
+                lambda facts: facts.source is not None and source.match(facts.source)
+            )
+
+        if definition.get("group"):
+            group = re.compile(definition["group"])
+            self.predicates.append(
+                lambda facts: any(group.search(name) for name in facts.groups)
+            )
+
+        self.style = {
+            key: definition[key] for key in STYLE_PROPERTIES if definition.get(key)
+        }
+        for key in ("text_color", "background_color"):
+            if key in self.style:
+                self.style[key] = QColor(self.style[key])
+
+    def matches(self, facts):
+        return all(predicate(facts) for predicate in self.predicates)
+
+
+class RuleSet:
+    """ Ordered list of compiled rules """
+
+    def __init__(self, source=""):
+        # JSON definition, used to detect changes of the rule set
+        self.source = source
+        self.rules = []
+
+        if not source:
+            return
+
+        try:
+            definitions = json.loads(source)
+        except ValueError as e:
+            QgsMessageLog.logMessage(f"Invalid layer tree rules: {e}")
+            return
+
+        for definition in definitions:
+            try:
+                rule = Rule(definition)
+            except (re.error, TypeError, AttributeError) as e:
+                QgsMessageLog.logMessage(f"Invalid layer tree rule {definition}: {e}")
+                continue
+            if rule.style:
+                self.rules.append(rule)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, node, category):
+        """ Return the RuleStyle of a node, or None if no rule matches """
+        if not self.rules:
+            return None
+
+        facts = node_facts(node, category)
+        style = {}
+        for rule in self.rules:
+            if len(style) == len(STYLE_PROPERTIES):
+                break
+            if rule.matches(facts):
+                for key, value in rule.style.items():
+                    style.setdefault(key, value)
+
+        return RuleStyle(**style) if style else None
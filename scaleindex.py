@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+""" Interval index over the layers scale ranges """
+
+from bisect import bisect_left, bisect_right, insort
+
+from qgis.core import QgsProject
+
+
+class ScaleRangeIndex:
+    """ Keep the set of the layers which are out of their scale range.
+
+    The minimum and maximum scales of the layers with a scale based visibility
+    are kept sorted, so that on a scale change only the layers with a scale
+    boundary between the previous and the new scale are evaluated """
+
+    # Tolerance on the boundaries (QgsMapLayer uses Qgis::SCALE_PRECISION)
+    EPSILON = 1e-6
+
+    def __init__(self):
+        self.scale = None
+        self.ranges = {}
+        self.bounds = []
+        self.out_of_scale = set()
+
+    def update_layer(self, layer):
+        """ Index the scale range of a layer. Return True if the layer got in or
+        out of scale """
+        self.drop_bounds(layer.id())
+
+        if layer.hasScaleBasedVisibility():
+            scales = tuple(
+                scale
+                for scale in (layer.minimumScale(), layer.maximumScale())
+                if scale > 0
+            )
+            self.ranges[layer.id()] = scales
+            for scale in scales:
+                insort(self.bounds, (scale, layer.id()))
+
+        return self.evaluate(layer)
+
+    def drop_bounds(self, layer_id):
+        for scale in self.ranges.pop(layer_id, ()):
+            del self.bounds[bisect_left(self.bounds, (scale, layer_id))]
+
+    def remove_layer(self, layer_id):
+        self.drop_bounds(layer_id)
+        self.out_of_scale.discard(layer_id)
+
+    def evaluate(self, layer):
+        """ Update the state of a layer for the current scale. Return True if it
+        changed """
+        was_out = layer.id() in self.out_of_scale
+        out = self.scale is not None and not layer.isInScaleRange(self.scale)
+        if out:
+            self.out_of_scale.add(layer.id())
+        else:
+            self.out_of_scale.discard(layer.id())
+        return out != was_out
+
+    def set_scale(self, scale):
+        """ Return the ids of the layers which got in or out of scale """
+        previous, self.scale = self.scale, scale
+        if previous is None:
+            candidates = set(self.ranges)
+        else:
+            low = min(previous, scale) * (1 - self.EPSILON)
+            high = max(previous, scale) * (1 + self.EPSILON)
+            first = bisect_left(self.bounds, (low,))
+            last = bisect_right(self.bounds, (high, chr(0x10FFFF)))
+            candidates = {layer_id for _, layer_id in self.bounds[first:last]}
+
+        flipped = []
+        for layer_id in candidates:
+            layer = QgsProject.instance().mapLayer(layer_id)
+            if layer and self.evaluate(layer):
+                flipped.append(layer_id)
+        return flipped
+
+    def is_out_of_scale(self, layer_id):
+        return layer_id in self.out_of_scale
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+""" Apply styles to many layer tree nodes at once
+
+Each setCustomProperty call emits customPropertyChanged, which makes the model
+repaint the node. A StyleBatch sets the node styles (see stylepalette.py) with
+the node signals blocked, and the model refreshes all the modified nodes once,
+when the batch is done:
+
+```
+with iface.layerTreeView().model().batch_update() as batch:
+    for node in nodes:
+        batch.set_icon(node, "path/to/icon.svg")
+        batch.set_font(node, QFont("Consolas", 12))
+```
+"""
+
+from PyQt5.QtGui import QFont, QColor
+
+from .stylepalette import NO_NODE_STYLE
+
+
+class StyleBatch:
+    """ Style changes applied without notifications. The modified nodes are
+    refreshed by CustomTreeModel.batch_update when the batch ends """
+
+    def __init__(self, palette):
+        self.palette = palette
+        # Modified nodes: {id: node}
+        self.nodes = {}
+        self.fonts_changed = False
+
+    def set_style(self, node, style):
+        """ Set the NodeStyle of a node """
+        if style.font != self.palette.node_style(node).font:
+            self.fonts_changed = True
+        blocked = node.blockSignals(True)
+        try:
+            self.palette.set_node_style(node, style)
+        finally:
+            node.blockSignals(blocked)
+
+        self.nodes[id(node)] = node
+
+    def set_field(self, node, field, value):
+        """ Set (or remove, if value is empty) a field of the node style """
+        style = self.palette.node_style(node)
+        self.set_style(node, style._replace(**{field: value or None}))
+
+    def set_icon(self, node, path):
+        self.set_field(node, "icon", path)
+
+    def set_font(self, node, font):
+        if isinstance(font, QFont):
+            font = font.toString()
+        self.set_field(node, "font", font)
+
+    def set_text_color(self, node, color):
+        if isinstance(color, QColor):
+            color = color.name()
+        self.set_field(node, "text_color", color)
+
+    def set_background_color(self, node, color):
+        if isinstance(color, QColor):
+            color = color.name()
+        self.set_field(node, "background_color", color)
+
+    def reset(self, node):
+        """ Remove the custom icon, font and colors of a node """
+        self.set_style(node, NO_NODE_STYLE)
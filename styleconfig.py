@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+""" Immutable snapshot of the plugins/layertreeicons settings
+
+Reading QSettings is too slow to be done on every repaint of the layer tree. The
+model reads a StyleConfig instead, which is loaded once and swapped as a whole
+whenever the settings are written.
+"""
+
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional
+
+from PyQt5.QtCore import QSettings
+from PyQt5.QtGui import QColor
+
+from .rules import RuleSet
+
+
+# QGIS icons used for each node category when no default icon is set
+DEFAULT_ICONS = MappingProxyType(
+    {
+        "group": ":/images/themes/default/mActionFolder.svg",
+        "raster": ":/images/themes/default/mIconRaster.svg",
+        "point": ":/images/themes/default/mIconPointLayer.svg",
+        "line": ":/images/themes/default/mIconLineLayer.svg",
+        "polygon": ":/images/themes/default/mIconPolygonLayer.svg",
+        "nogeometry": ":/images/themes/default/mIconTableLayer.svg",
+        "mesh": ":/images/themes/default/mIconMeshLayer.svg",
+    }
+)
+
+
+def color_value(settings, key):
+    """ Return the color stored in settings, or None if unset """
+    value = settings.value(key, "")
+    if not value:
+        return None
+    return QColor(value)
+
+
+class StyleConfig(NamedTuple):
+    """ Default style of the layer tree nodes """
+
+    group_font: str
+    layer_font: str
+    group_text_color: Optional[QColor]
+    group_background_color: Optional[QColor]
+    layer_text_color: Optional[QColor]
+    layer_background_color: Optional[QColor]
+    icon_size: int
+    # Render the legend symbols in background threads
+    async_legend_rendering: bool
+    # Maximum number of symbols rendered concurrently
+    legend_render_jobs: int
+    # Only build the decoration of the rows in view, plus a prefetch margin
+    lazy_decorations: bool
+    prefetch_rows: int
+    # Icon path for each node category (custom icon, or QGIS default icon)
+    default_icons: Mapping[str, str]
+    # Compiled styling rules, see rules.py
+    rules: RuleSet
+
+    @classmethod
+    def load(cls):
+        """ Read the configuration from the plugins/layertreeicons settings """
+        settings = QSettings()
+        settings.beginGroup("plugins/layertreeicons")
+
+        default_icons = {
+            key: settings.value(f"defaulticons/{key}", "") or path
+            for key, path in DEFAULT_ICONS.items()
+        }
+
+        return cls(
+            group_font=settings.value("group_font", "") or "",
+            layer_font=settings.value("layer_font", "") or "",
+            group_text_color=color_value(settings, "group_text_color"),
+            group_background_color=color_value(settings, "group_background_color"),
+            layer_text_color=color_value(settings, "layer_text_color"),
+            layer_background_color=color_value(settings, "layer_background_color"),
+            icon_size=settings.value("iconsize", -1, int),
+            async_legend_rendering=settings.value(
+                "async_legend_rendering", False, bool
+            ),
+            legend_render_jobs=max(1, settings.value("legend_render_jobs", 2, int)),
+            lazy_decorations=settings.value("lazy_decorations", False, bool),
+            prefetch_rows=max(0, settings.value("prefetch_rows", 20, int)),
+            default_icons=MappingProxyType(default_icons),
+            rules=RuleSet(settings.value("rules", "") or ""),
+        )
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+""" Export and import of the layer tree styles, as line-delimited JSON
+
+The first line holds the default styles (the plugins/layertreeicons settings),
+each following line the custom style of a node:
+
+```
+{"defaults": {"group_font": "Sans,10,-1,5,75,0,0,0,0,0", "iconsize": 24}}
+{"path": ["Roads", "highways"], "layer_id": "highways_1f2e", "icon": "road.svg"}
+```
+
+Both directions stream: the nodes are written while the tree is walked. On
+import, the file is validated line by line, then read again and applied in a
+single StyleBatch. A node is matched by layer id, then by layer source, then
+by tree path.
+"""
+
+import json
+
+from PyQt5.QtCore import QSettings, QSize
+
+from qgis.core import QgsLayerTree
+from qgis.utils import iface
+
+from .styleconfig import DEFAULT_ICONS
+from .stylepalette import NO_NODE_STYLE, NodeStyle
+
+
+# Settings exported along with the node styles
+DEFAULT_KEYS = (
+    "group_font",
+    "layer_font",
+    "group_text_color",
+    "group_background_color",
+    "layer_text_color",
+    "layer_background_color",
+    "iconsize",
+    "rules",
+) + tuple(f"defaulticons/{key}" for key in DEFAULT_ICONS)
+
+
+def tree_nodes(group, path=()):
+    """ Yield (node, tree path) for every descendant of group. The tree path is
+    the tuple of the node name and of its parent group names """
+    for child in group.children():
+        child_path = path + (child.name(),)
+        yield child, child_path
+        if QgsLayerTree.isGroup(child):
+            yield from tree_nodes(child, child_path)
+
+
+class NodeMatcher:
+    """ Find the nodes of a layer tree by layer id, layer source or tree path.
+    The source and path indexes are only built when first needed """
+
+    def __init__(self, root):
+        self.root = root
+        # {layer source: node}
+        self.sources = None
+        # {tree path: node}
+        self.paths = None
+
+    def by_source(self, source):
+        if self.sources is None:
+            self.sources = {}
+            for node in self.root.findLayers():
+                if node.layer():
+                    self.sources.setdefault(node.layer().source(), node)
+        return self.sources.get(source)
+
+    def by_path(self, path):
+        if self.paths is None:
+            self.paths = {}
+            for node, node_path in tree_nodes(self.root):
+                self.paths.setdefault(node_path, node)
+        return self.paths.get(tuple(path))
+
+    def match(self, entry):
+        """ Return the node an exported entry applies to, or None """
+        node = None
+        if entry.get("layer_id"):
+            node = self.root.findLayer(entry["layer_id"])
+        if node is None and entry.get("source"):
+            node = self.by_source(entry["source"])
+        if node is None and entry.get("path"):
+            node = self.by_path(entry["path"])
+        return node
+
+
+def export_styles(filename, model):
+    """ Write the default styles and the style of every styled node of the
+    model in filename. Returns the number of exported nodes """
+    settings = QSettings()
+    settings.beginGroup("plugins/layertreeicons")
+    defaults = {
+        key: settings.value(key) for key in DEFAULT_KEYS if settings.contains(key)
+    }
+
+    count = 0
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"defaults": defaults}, default=str) + "\n")
+        for node, path in tree_nodes(model.rootGroup()):
+            style = model.palette.node_style(node)
+            if style == NO_NODE_STYLE:
+                continue
+
+            entry = {"path": path}
+            if QgsLayerTree.isLayer(node):
+                entry["layer_id"] = node.layerId()
+                if node.layer():
+                    entry["source"] = node.layer().source()
+            entry.update(
+                {field: value for field, value in style._asdict().items() if value}
+            )
+            f.write(json.dumps(entry) + "\n")
+            count += 1
+    return count
+
+
+def read_entries(f):
+    """ Yield the entries of an exported file. Raises ValueError on invalid
+    lines """
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            if not isinstance(entry, dict):
+                raise ValueError("not a JSON object")
+            if "defaults" in entry:
+                if not isinstance(entry["defaults"], dict):
+                    raise ValueError("defaults is not a JSON object")
+            else:
+                path = entry.get("path", [])
+                if not isinstance(path, list) or not all(
+                    isinstance(name, str) for name in path
+                ):
+                    raise ValueError("path is not a list of names")
+                for field in ("layer_id", "source") + NodeStyle._fields:
+                    if not isinstance(entry.get(field) or "", str):
+                        raise ValueError(f"{field} is not a string")
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from e
+        yield entry
+
+
+def import_styles(filename, model, defaults=True):
+    """ Apply the styles exported in filename to the nodes of the model, and,
+    if defaults is True, the default styles. Returns the numbers of styled and
+    of unmatched nodes.
+
+    The file is read twice: the whole file is validated before anything is
+    applied, so that an invalid line raises ValueError without importing any
+    style """
+    matcher = NodeMatcher(model.rootGroup())
+    styled = unmatched = 0
+    defaults_changed = False
+
+    with open(filename, encoding="utf-8") as f:
+        for _ in read_entries(f):
+            pass
+
+        f.seek(0)
+        with model.batch_update() as batch:
+            for entry in read_entries(f):
+                if "defaults" in entry:
+                    if defaults:
+                        settings = QSettings()
+                        settings.beginGroup("plugins/layertreeicons")
+                        for key, value in entry["defaults"].items():
+                            if key in DEFAULT_KEYS:
+                                settings.setValue(key, value)
+                        defaults_changed = True
+                    continue
+
+                node = matcher.match(entry)
+                if node is None:
+                    unmatched += 1
+                    continue
+                style = NodeStyle(
+                    **{field: entry.get(field) or None for field in NodeStyle._fields}
+                )
+                batch.set_style(node, style)
+                styled += 1
+
+    if defaults_changed:
+        model.reload_settings()
+        icon_size = model.style.icon_size
+        iface.layerTreeView().setIconSize(QSize(icon_size, icon_size))
+    return styled, unmatched
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+""" Project-level palette of node styles
+
+The custom icon, font and colors of the nodes are stored once per project, in
+the layertreeicons/palette project entry, as a JSON dict {style id: style}.
+Each styled node only stores the id of its style, in the
+plugins/customTreeIcon/style custom property:
+
+```
+{"4d5c0e1f2a3b": {"icon": "path/to/icon.svg", "text_color": "#aa0000"}}
+```
+
+The style ids are derived from the style content, so that an id means the same
+style in every project: nodes brought from another project (layer definition
+files, copy and paste) never get the style of another node. Their styles are
+found in the registry of all the styles seen in the user profile, saved under
+layertreeicons/styles.json in the profile directory.
+
+Nodes with the former per-node custom properties (plugins/customTreeIcon/icon,
+font, textColor and backgroundColor), from older projects or set by scripts, are
+moved to the palette when the project is read or when the property is set.
+"""
+
+import json
+import os
+from hashlib import sha1
+from typing import NamedTuple, Optional
+
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
+
+
+STYLE_KEY = "plugins/customTreeIcon/style"
+
+ICON_KEY = "plugins/customTreeIcon/icon"
+FONT_KEY = "plugins/customTreeIcon/font"
+TEXT_COLOR_KEY = "plugins/customTreeIcon/textColor"
+BACKGROUND_COLOR_KEY = "plugins/customTreeIcon/backgroundColor"
+
+# Former per-node custom properties: {custom property: NodeStyle field}
+PROPERTY_FIELDS = {
+    ICON_KEY: "icon",
+    FONT_KEY: "font",
+    TEXT_COLOR_KEY: "text_color",
+    BACKGROUND_COLOR_KEY: "background_color",
+}
+
+
+class NodeStyle(NamedTuple):
+    """ Custom style of a node. The font is a QFont string and the colors are
+    color names """
+
+    icon: Optional[str] = None
+    font: Optional[str] = None
+    text_color: Optional[str] = None
+    background_color: Optional[str] = None
+
+
+NO_NODE_STYLE = NodeStyle()
+
+def style_id(style):
+    """ Identifier of a style, derived from its content """
+    return sha1(json.dumps(list(style)).encode()).hexdigest()[:12]
+
+
+def parse_style(properties):
+    """ Return the NodeStyle of a style stored as a dict, or None if it is
+    invalid """
+    if not isinstance(properties, dict):
+        return None
+    values = {field: properties.get(field) or None for field in NodeStyle._fields}
+    if not all(value is None or isinstance(value, str) for value in values.values()):
+        return None
+    return NodeStyle(**values)
+
+
+class StyleRegistry:
+    """ Every style of the palettes seen in the user profile, loaded from and
+    saved to the profile directory """
+
+    def __init__(self):
+        # {style id: NodeStyle}
+        self.styles = {}
+        self.loaded = False
+        self.dirty = False
+
+    @staticmethod
+    def path():
+        return os.path.join(
+            QgsApplication.qgisSettingsDirPath(), "layertreeicons", "styles.json"
+        )
+
+    def load(self):
+        self.loaded = True
+        try:
+            with open(self.path(), encoding="utf-8") as f:
+                styles = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(styles, dict):
+            return
+        for key, properties in styles.items():
+            style = parse_style(properties)
+            # Ignore the styles edited by hand
+            if style is not None and style_id(style) == key:
+                self.styles.setdefault(key, style)
+
+    def save(self):
+        """ Write the registry, if styles were added since it was loaded """
+        if not self.dirty:
+            return
+        styles = {
+            key: {field: value for field, value in style._asdict().items() if value}
+            for key, style in self.styles.items()
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path()), exist_ok=True)
+            with open(self.path(), "w", encoding="utf-8") as f:
+                json.dump(styles, f, separators=(",", ":"))
+        except OSError as e:
+            QgsMessageLog.logMessage(f"Could not save the style registry: {e}")
+            return
+        self.dirty = False
+
+    def add(self, key, style):
+        if not self.loaded:
+            self.load()
+        if key not in self.styles:
+            self.styles[key] = style
+            self.dirty = True
+
+    def get(self, key):
+        if not self.loaded:
+            self.load()
+        return self.styles.get(key)
+
+
+class StylePalette:
+    """ Distinct styles of the project nodes, referenced by id """
+
+    SCOPE = "layertreeicons"
+    ENTRY = "palette"
+
+    def __init__(self):
+        # {style id: NodeStyle}
+        self.styles = {}
+        # {NodeStyle: style id}
+        self.ids = {}
+
+    def clear(self):
+        self.styles.clear()
+        self.ids.clear()
+
+    def add(self, style_id, style):
+        self.styles[style_id] = style
+        self.ids[style] = style_id
+        style_registry.add(style_id, style)
+
+    def load(self, project):
+        """ Read the palette from the project entry. Returns the ids of the
+        entry which do not match their style content (e.g. edited by hand), to
+        be resolved on the project nodes: {entry id: style id} """
+        self.clear()
+        aliases = {}
+        source, _ = project.readEntry(self.SCOPE, self.ENTRY, "")
+        if not source:
+            return aliases
+        try:
+            styles = json.loads(source)
+            if not isinstance(styles, dict):
+                raise ValueError("not a JSON object")
+        except ValueError as e:
+            QgsMessageLog.logMessage(
+                f"Invalid style palette: {e}", "LayerTreeIcons", Qgis.Warning
+            )
+            return aliases
+        for loaded_id, properties in styles.items():
+            style = parse_style(properties)
+            if style is None:
+                QgsMessageLog.logMessage(
+                    f"Invalid style {loaded_id} in the palette: {properties}",
+                    "LayerTreeIcons",
+                    Qgis.Warning,
+                )
+                continue
+            interned_id = self.intern(style)
+            if loaded_id != interned_id:
+                aliases[loaded_id] = interned_id
+        return aliases
+
+    def save(self, project):
+        """ Write the palette in the project entry """
+        styles = {
+            style_id: {key: value for key, value in style._asdict().items() if value}
+            for style_id, style in self.styles.items()
+        }
+        project.writeEntry(
+            self.SCOPE, self.ENTRY, json.dumps(styles, separators=(",", ":"))
+        )
+
+    def prune(self, nodes):
+        """ Drop the styles which none of nodes references. Returns True if any
+        style was dropped """
+        used = {node.customProperty(STYLE_KEY) for node in nodes}
+        unused = [style_id for style_id in self.styles if style_id not in used]
+        for style_id in unused:
+            style = self.styles.pop(style_id)
+            if self.ids.get(style) == style_id:
+                del self.ids[style]
+        return bool(unused)
+
+    def intern(self, style):
+        """ Return the id of a style, after adding it to the palette if needed.
+        The empty style has no id """
+        if style == NO_NODE_STYLE:
+            return None
+        if style not in self.ids:
+            self.add(style_id(style), style)
+        return self.ids[style]
+
+    def resolve(self, node, aliases=None):
+        """ Make the style id of a node, e.g. read from another project, refer
+        to this palette. aliases are the ids returned by load, only valid for
+        the nodes of the loaded project. Returns True if the palette or the
+        node changed """
+        node_id = node.customProperty(STYLE_KEY)
+        if not node_id or node_id in self.styles:
+            return False
+
+        if aliases and node_id in aliases:
+            blocked = node.blockSignals(True)
+            try:
+                node.setCustomProperty(STYLE_KEY, aliases[node_id])
+            finally:
+                node.blockSignals(blocked)
+            return True
+
+        # Style of another palette of the profile
+        style = style_registry.get(node_id)
+        if style is not None:
+            self.add(node_id, style)
+            return True
+        return False
+
+    def is_unknown(self, node):
+        """ Whether the node references a style missing from the palette """
+        node_id = node.customProperty(STYLE_KEY)
+        return bool(node_id) and node_id not in self.styles
+
+    def node_style(self, node):
+        style_id = node.customProperty(STYLE_KEY)
+        if not style_id:
+            return NO_NODE_STYLE
+        return self.styles.get(style_id, NO_NODE_STYLE)
+
+    def set_node_style(self, node, style):
+        """ Make node reference style, or remove its style if it is empty """
+        style_id = self.intern(style)
+        if style_id:
+            node.setCustomProperty(STYLE_KEY, style_id)
+        else:
+            node.removeCustomProperty(STYLE_KEY)
+
+    def migrate(self, node):
+        """ Move the former style custom properties of a node to the palette,
+        with the node signals blocked. Returns True if the node had any """
+        properties = {
+            field: node.customProperty(key) for key, field in PROPERTY_FIELDS.items()
+        }
+        properties = {field: value for field, value in properties.items() if value}
+        if not properties:
+            return False
+
+        style = self.node_style(node)._replace(**properties)
+        blocked = node.blockSignals(True)
+        try:
+            for key in PROPERTY_FIELDS:
+                node.removeCustomProperty(key)
+            self.set_node_style(node, style)
+        finally:
+            node.blockSignals(blocked)
+        return True
+
+
+# Shared instance
+style_registry = StyleRegistry()
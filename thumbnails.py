@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+""" Icon thumbnails rasterized in a thread pool """
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from .iconcache import rasterize
+
+
+class ThumbnailSignals(QObject):
+    finished = pyqtSignal(str, QImage)
+
+
+class ThumbnailTask(QRunnable):
+    """ Rasterize an icon in a QImage, outside of the GUI thread """
+
+    def __init__(self, path, size, device_pixel_ratio):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = ThumbnailSignals()
+        self.path = path
+        self.size = size
+        self.device_pixel_ratio = device_pixel_ratio
+
+    def run(self):
+        image = rasterize(self.path, self.size, self.device_pixel_ratio)
+        self.signals.finished.emit(self.path, image)
+
+
+class ThumbnailLoader(QObject):
+    """ Rasterize icons in a thread pool.
+
+    The last requested icons are rendered first: they are the rows the view
+    painted last, i.e. the rows in view. Background requests (e.g. a whole
+    folder) are only rendered when no other request is waiting """
+
+    finished = pyqtSignal(str, QImage)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        # {path: task}
+        self.pending = {}
+        # Priority of the next request
+        self.priority = 1
+
+    def request(self, path, size, device_pixel_ratio, background=False):
+        """ Schedule the rasterization of an icon. A pending request is moved
+        to the front of the queue """
+        task = self.pending.get(path)
+        if task is not None:
+            if background or not self.pool.tryTake(task):
+                # Already running
+                return
+        else:
+            task = ThumbnailTask(path, size, device_pixel_ratio)
+            task.signals.finished.connect(self.on_finished)
+            self.pending[path] = task
+
+        if background:
+            priority = 0
+        else:
+            priority = self.priority
+            self.priority += 1
+        self.pool.start(task, priority)
+
+    def on_finished(self, path, image):
+        self.pending.pop(path, None)
+        self.finished.emit(path, image)
+
+    def cancel_all(self):
+        """ Drop the requests which did not start yet """
+        for path, task in list(self.pending.items()):
+            if self.pool.tryTake(task):
+                del self.pending[path]
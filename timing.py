@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+""" Duration of the plugin startup phases """
+
+from time import perf_counter
+
+from qgis.core import Qgis, QgsMessageLog
+
+
+class StartupTimer:
+    """ Measure the consecutive phases of the plugin startup, and report them
+    in the LayerTreeIcons tab of the message log """
+
+    def __init__(self):
+        self.phases = []
+        self.last = perf_counter()
+
+    def start(self):
+        self.last = perf_counter()
+
+    def mark(self, phase):
+        """ End a phase, started at the previous mark (or start) """
+        now = perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        total = sum(duration for _, duration in self.phases)
+        lines = [f"Startup: {total * 1000:.1f} ms"]
+        lines.extend(
+            f"  {phase}: {duration * 1000:.1f} ms" for phase, duration in self.phases
+        )
+        QgsMessageLog.logMessage("\n".join(lines), "LayerTreeIcons", Qgis.Info)
+        self.phases.clear()
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" Track the rows displayed by the layer tree view """
+
+from PyQt5.QtCore import QObject, QEvent, QPoint, QTimer, pyqtSignal
+
+
+class ViewportTracker(QObject):
+    """ Keep the set of the index internal ids displayed by a tree view, plus a
+    prefetch margin of rows above and below the viewport.
+
+    The set is updated (at most once per event loop iteration) when the view is
+    scrolled, resized, or when rows are expanded, collapsed, added or removed """
+
+    changed = pyqtSignal()
+
+    def __init__(self, view, model):
+        super().__init__(model)
+        self.view = view
+        self.model = model
+        self.margin = 0
+        self.hot = set()
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.update)
+
+        view.verticalScrollBar().valueChanged.connect(self.schedule_update)
+        view.expanded.connect(self.schedule_update)
+        view.collapsed.connect(self.schedule_update)
+        view.viewport().installEventFilter(self)
+        model.rowsInserted.connect(self.schedule_update)
+        model.rowsRemoved.connect(self.schedule_update)
+        model.modelReset.connect(self.schedule_update)
+        model.layoutChanged.connect(self.schedule_update)
+
+    def teardown(self):
+        """ Stop tracking the view """
+        self.timer.stop()
+        self.view.verticalScrollBar().valueChanged.disconnect(self.schedule_update)
+        self.view.expanded.disconnect(self.schedule_update)
+        self.view.collapsed.disconnect(self.schedule_update)
+        self.view.viewport().removeEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Resize:
+            self.schedule_update()
+        return False
+
+    def set_margin(self, margin):
+        self.margin = margin
+        self.schedule_update()
+
+    def schedule_update(self, *args):
+        self.timer.start()
+
+    def is_hot(self, index):
+        """ Whether the index is displayed, or within the prefetch margin """
+        return index.internalId() in self.hot
+
+    def update(self):
+        # The plugin was unloaded
+        if self.view.model() is not self.model:
+            return
+
+        hot = set()
+        index = self.view.indexAt(QPoint(1, 1))
+        if index.isValid():
+            above = self.view.indexAbove(index)
+            for _ in range(self.margin):
+                if not above.isValid():
+                    break
+                hot.add(above.internalId())
+                above = self.view.indexAbove(above)
+
+            height = self.view.viewport().height()
+            while index.isValid() and self.view.visualRect(index).top() < height:
+                hot.add(index.internalId())
+                index = self.view.indexBelow(index)
+
+            for _ in range(self.margin):
+                if not index.isValid():
+                    break
+                hot.add(index.internalId())
+                index = self.view.indexBelow(index)
+
+        self.hot = hot
+        self.changed.emit()